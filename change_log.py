@@ -0,0 +1,106 @@
+from pickle import dumps, loads
+from struct import Struct
+from time import time
+
+# every record is prefixed with its length in bytes
+HEADER = Struct(">I")
+
+
+class ChangeLog:
+    """
+    ChangeLog is an append-only file of the updates made to a Database, in
+    the order they were made. Each record is a tuple of (sequence number,
+    timestamp, operation, fields).
+    """
+
+    def __init__(self, path):
+        """
+        Open a ChangeLog for appending, creating it if needed.
+
+        Args:
+            path (Path): The path of the log file.
+
+        Returns:
+            (ChangeLog): The initialized ChangeLog object.
+        """
+        self.path = path
+        self.file = path.open(mode="ab")
+        self.resync()
+
+    def append(self, op, fields):
+        """
+        Append a record to the log and flush it so readers can see it.
+
+        Args:
+            op (str): The name of the operation.
+            fields (dict): The arguments of the operation.
+
+        Returns:
+            (int): The sequence number of the record.
+        """
+        self.seq += 1
+        record = dumps((self.seq, time(), op, fields))
+        self.file.write(HEADER.pack(len(record)) + record)
+        self.file.flush()
+        self.offset += HEADER.size + len(record)
+        return self.seq
+
+    def resync(self):
+        """
+        Count the records in the log, which other processes may have
+        appended to, and drop a record that was cut short.
+        """
+        self.offset = 0
+        self.seq = 0
+        for self.offset, _ in ChangeLog.read(self.path, decode=False):
+            self.seq += 1
+        self.file.truncate(self.offset)
+
+    def truncate(self, offset, seq):
+        """
+        Drop every record after offset, such as records appended by a
+        writer that stopped before saving them.
+
+        Args:
+            offset (int): The byte offset to keep records up to.
+            seq (int): The sequence number of the record ending at offset.
+        """
+        self.file.truncate(offset)
+        self.offset = offset
+        self.seq = seq
+
+    def close(self):
+        """
+        Close the log file.
+        """
+        self.file.close()
+
+    @staticmethod
+    def read(path, offset=0, decode=True):
+        """
+        Yield the complete records in a log file from offset onwards. A
+        record still being written is not yielded.
+
+        Args:
+            path (Path): The path of the log file.
+            offset (int): The byte offset to start reading at.
+            decode (bool): If False, records are not unpickled.
+
+        Yields:
+            (tuple): The offset after the record and the record itself, or
+            None if decode is False.
+        """
+        if not path.exists():
+            return
+        with path.open(mode="rb") as f:
+            f.seek(offset)
+            while True:
+                header = f.read(HEADER.size)
+                if len(header) < HEADER.size:
+                    return
+                (size,) = HEADER.unpack(header)
+                record = f.read(size)
+                if len(record) < size:
+                    return
+                offset += HEADER.size + size
+                yield offset, loads(record) if decode else None
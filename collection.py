@@ -1,6 +1,7 @@
 from node import Node
 from uuid import uuid4
 from file_ops import FileOps
+from ordered import OrderedIndex
 
 
 class Collection(FileOps):
@@ -8,15 +9,20 @@ class Collection(FileOps):
     A Collection is representative of a graph structure.
     """
 
-    def __init__(self, file):
+    def __init__(self, file, name=None):
         """
         Initialize a Collection.
 
+        Args:
+            file (FileOps): The FileOps object of the Database.
+            name (str|None): The name of the Collection in the Database.
+
         Returns:
             (Collection): The initialized Collection object.
         """
-        self.nodes = {}
+        self.nodes = OrderedIndex()
         self.file = file
+        self.name = name
 
     def __str__(self):
         """
@@ -31,6 +37,26 @@ class Collection(FileOps):
         ]
         return "nodes: {{{}".format(",".join(nodes))
 
+    def scan(self, limit=100, after=None):
+        """
+        Return a page of the nodes in this collection, in the order they
+        were inserted. Each page costs O(limit).
+
+        Args:
+            limit (int): The maximum number of nodes to return.
+            after (int|None): The cursor returned with the previous page, or
+            None for the first page.
+
+        Returns:
+            (tuple): A dict of the Nodes in the page by key and the cursor of
+            the next page, which is None when there are no more nodes.
+
+        Raises:
+            Exception: If limit is not a positive int.
+        """
+        keys, cursor = self.nodes.page(limit, after)
+        return {key: self.nodes[key] for key in keys}, cursor
+
     @FileOps.save_on_update
     def insert(self, data, key=None):
         """
@@ -67,10 +93,16 @@ class Collection(FileOps):
         node = Node(uuid, data, self.file)
 
         # insert the node into nodes
-        if key is None:
-            self.nodes[uuid] = node
-        else:
-            self.nodes[key] = node
+        self.file.insert_node(self, uuid if key is None else key, node)
+
+        # publish the update to replicas
+        self.file.publish(
+            "insert",
+            collection=self.name,
+            key=uuid if key is None else key,
+            id=uuid,
+            data=data,
+        )
 
         # return the node
         return node
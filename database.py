@@ -6,6 +6,9 @@ from file_ops import FileOps
 from datetime import datetime
 import json
 
+# query, snapshot, sketches and views are imported where they are first
+# used, so opening a database does not load them
+
 
 class Database(FileOps):
     """
@@ -13,20 +16,29 @@ class Database(FileOps):
     references to all data contained in the Database itself.
     """
 
-    def __init__(self, file_name="data"):
+    def __init__(
+        self, file_name="data", cache_bytes=None, publish=False, lazy=False
+    ):
         """
         Initialize a Database object.
 
+        Args:
+            file_name (str): The directory the database is stored in.
+            cache_bytes (int|None): If specified, Node data is kept on disk
+            and loaded lazily through an LRU cache holding at most this many
+            bytes, while relations stay in memory.
+            publish (bool): If True, every update is appended to a change log
+            in the database directory that Replica objects can follow.
+            lazy (bool): If True, opening the Database only reads its small
+            manifest, and the Nodes are loaded the first time they are
+            used. num_nodes is answered from the manifest until then.
+
         Returns:
             (Database): The initialized Database object.
         """
-        self.file = FileOps(file_name)
-
-        try:
-            self.nodes = self.file.nodes
-            self.collections = self.file.collections
-        except AttributeError as e:
-            print(e)
+        self.file = FileOps(file_name, cache_bytes, publish, lazy)
+        self._statistics = None
+        self._sketch = None
 
     def __str__(self):
         """
@@ -46,6 +58,26 @@ class Database(FileOps):
             ",".join(collections), ",".join(nodes)
         )
 
+    @property
+    def nodes(self):
+        """
+        Return the Nodes in this Database that are not in a Collection.
+
+        Returns:
+            (dict): The Nodes by key.
+        """
+        return self.file.nodes
+
+    @property
+    def collections(self):
+        """
+        Return the Collections in this Database.
+
+        Returns:
+            (dict): The Collections by name.
+        """
+        return self.file.collections
+
     @property
     def num_nodes(self):
         """
@@ -54,6 +86,9 @@ class Database(FileOps):
         Returns:
             (int): The number of nodes in this Database.
         """
+        # a lazily opened database can count its nodes from the manifest
+        if self.file.pending and "sizes" in self.file.manifest:
+            return sum(self.file.manifest["sizes"].values())
         return len(self.nodes) + sum(
             len(c.nodes) for c in self.collections.values()
         )
@@ -77,6 +112,20 @@ class Database(FileOps):
             (dict): The associations in this Database organized by label as
             the key and a list of edges (tuple of nodes) as the value.
         """
+        return self.find_associations()
+
+    def find_associations(self, snapshot=None):
+        """
+        Return the associations in this Database, or in a Snapshot of it.
+
+        Args:
+            snapshot (Snapshot|None): If specified, the Snapshot to read.
+
+        Returns:
+            (dict): The associations organized by label as the key and a list
+            of edges (tuple of nodes) as the value.
+        """
+        view = getattr if snapshot is None else snapshot.view
 
         # create needed data structures
         result = {}
@@ -84,9 +133,9 @@ class Database(FileOps):
         visited = set()
 
         # for each collection
-        for collection in self.collections.values():
+        for collection in view(self.file, "collections").values():
             # add nodes in collection to queue
-            for node in collection.nodes.values():
+            for node in view(collection, "nodes").values():
                 queue.put(node)
             # while there are nodes in the queue
             while queue.qsize() > 0:
@@ -97,7 +146,7 @@ class Database(FileOps):
                     # mark it as visited
                     visited.add(node)
                     # iterate over its relations
-                    for relation, label in node.relations.items():
+                    for relation, label in view(node, "relations").items():
                         # add the relation to the queue
                         queue.put(relation)
                         # add the label to result
@@ -109,6 +158,209 @@ class Database(FileOps):
         # return the resulting dict or relations
         return result
 
+    def scan(self, limit=100, after=None):
+        """
+        Return a page of the Nodes that are not in a Collection, in the
+        order they were inserted. Each page costs O(limit).
+
+        Args:
+            limit (int): The maximum number of nodes to return.
+            after (int|None): The cursor returned with the previous page, or
+            None for the first page.
+
+        Returns:
+            (tuple): A dict of the Nodes in the page by key and the cursor of
+            the next page, which is None when there are no more nodes.
+
+        Raises:
+            Exception: If limit is not a positive int.
+        """
+        keys, cursor = self.nodes.page(limit, after)
+        return {key: self.nodes[key] for key in keys}, cursor
+
+    def read_snapshot(self):
+        """
+        Return a Snapshot of this Database for use in a with statement.
+        Reads through the Snapshot see the Database as it was when the with
+        block started, while writes carry on without waiting for it.
+
+        Returns:
+            (Snapshot): The unopened Snapshot.
+        """
+        from snapshot import Snapshot
+
+        return Snapshot(self)
+
+    @property
+    def statistics(self):
+        """
+        Return label and degree statistics for this Database. They are
+        collected on first use and then kept up to date as Nodes are
+        inserted and related.
+
+        Returns:
+            (Statistics): The statistics of this Database.
+        """
+        if self._statistics is None:
+            # collect them while no writes are in progress
+            with self.file.write_lock:
+                if self._statistics is None:
+                    from query import Statistics
+
+                    statistics = Statistics(self.file)
+                    self.file.trackers.append(statistics)
+                    self._statistics = statistics
+        return self._statistics
+
+    def sketch(self, hops=3, precision=10, width=2048, depth=4, max_age=60.0):
+        """
+        Return sketches that approximately answer neighborhood size, label
+        cardinality and degree questions about this Database. Label and
+        degree counts are kept up to date as Nodes are related. Neighborhood
+        sizes are rebuilt in the background once they are max_age seconds
+        old and the Database changed, so they lag behind writes by at most
+        max_age seconds plus the time a rebuild takes. The sketches are
+        built again when called with other arguments.
+
+        Args:
+            hops (int): The largest number of hops to estimate
+            neighborhood sizes for.
+            precision (int): HyperLogLog precision, each extra bit doubles
+            memory and cuts the error by about 30%.
+            width (int): CountMinSketch width, error is about e / width of
+            the number of relations.
+            depth (int): CountMinSketch depth, the error bound fails with
+            probability about e ** -depth.
+            max_age (float): The number of seconds after which neighborhood
+            sizes are rebuilt if the Database changed.
+
+        Returns:
+            (GraphSketch): The sketches of this Database.
+        """
+        sketch = self._sketch
+        if sketch is None or (
+            sketch.hops,
+            sketch.precision,
+            sketch.width,
+            sketch.depth,
+        ) != (hops, precision, width, depth):
+            # build them while no writes are in progress
+            with self.file.write_lock:
+                from sketches import GraphSketch
+
+                sketch = GraphSketch(
+                    self, hops, precision, width, depth, max_age
+                )
+                if self._sketch is not None:
+                    self.file.trackers.remove(self._sketch)
+                self.file.trackers.append(sketch)
+                self._sketch = sketch
+        sketch.max_age = max_age
+        return sketch
+
+    @property
+    def views(self):
+        """
+        Return the materialized views of this Database.
+
+        Returns:
+            (dict): The MaterializedView objects by name.
+        """
+        return self.file.views
+
+    def materialize(self, view_name, label_1, label_2, collection=None):
+        """
+        Create a view that keeps the result of a two hop related_difference
+        up to date for every Node, or every Node in a Collection. Relating
+        and unrelating Nodes updates the view, so reading it is a dict
+        lookup. Views are kept in memory and are not saved.
+
+        Args:
+            view_name (str): The name of the view.
+            label_1 (any): The label of the direct relations.
+            label_2 (any): The label of the indirect relations.
+            collection (str|None): If specified, only Nodes in this
+            Collection are tracked.
+
+        Returns:
+            (MaterializedView): The view, see MaterializedView.get.
+
+        Raises:
+            Exception: If view_name is already a view of this Database.
+            Exception: If collection is not in this Database.
+        """
+
+        # view_name must not already exist
+        if view_name in self.views:
+            raise Exception(f"view {view_name} already exists")
+
+        # collection must exist in db
+        if collection is not None and collection not in self.collections:
+            raise Exception(f"collection {collection} not in this database")
+
+        # build the view while no writes are in progress
+        with self.file.write_lock:
+            from views import MaterializedView
+
+            view = MaterializedView(self.file, label_1, label_2, collection)
+            self.views[view_name] = view
+            self.file.trackers.append(view)
+        return view
+
+    def drop_view(self, view_name):
+        """
+        Stop maintaining a materialized view.
+
+        Args:
+            view_name (str): The name of the view.
+
+        Raises:
+            Exception: If view_name is not a view of this Database.
+        """
+        with self.file.write_lock:
+            if view_name not in self.views:
+                raise Exception(f"view {view_name} does not exist")
+            self.file.trackers.remove(self.views.pop(view_name))
+
+    def match(self, pattern, **bindings):
+        """
+        Find every path in this Database that matches pattern. The order in
+        which edges are expanded is chosen from label and degree statistics,
+        so patterns do not need to be written in any particular order.
+
+        Args:
+            pattern (str): The pattern to match, for example
+            "(a:users)-[:FRIENDS_WITH]->(b)-[:LIKES]->(c)". Each node is
+            (name), (name:collection) or (:collection) and each edge is
+            -[:LABEL]->, <-[:LABEL]- or -[]-> for any label.
+            **bindings (Node): Variables in pattern that must match a
+            specific Node.
+
+        Returns:
+            (Query): An iterable that lazily yields each match as a dict of
+            variable name to Node.
+
+        Raises:
+            Exception: If pattern is not a valid pattern.
+            Exception: If a binding is not a Node or not in pattern.
+        """
+        from query import Query
+
+        return Query(self, pattern, bindings)
+
+    def explain(self, pattern, **bindings):
+        """
+        Return the plan match would use for pattern.
+
+        Args:
+            pattern (str): The pattern to plan.
+            **bindings (Node): Variables in pattern bound to a Node.
+
+        Returns:
+            (str): The chosen plan, one expansion per line.
+        """
+        return str(self.match(pattern, **bindings).plan)
+
     @FileOps.save_on_update
     def add(self, collection_name):
         """
@@ -142,7 +394,12 @@ class Database(FileOps):
             raise Exception("collection already exists in database")
 
         # create the collection
-        self.collections[collection_name] = Collection(self.file)
+        collections = self.file.writable(self.file, "collections")
+        collection = Collection(self.file, collection_name)
+        collections[collection_name] = collection
+
+        # publish the update to replicas
+        self.file.publish("add", name=collection_name)
 
         # return the collection
         return self.collections[collection_name]
@@ -187,10 +444,16 @@ class Database(FileOps):
         node = Node(uuid, data, self.file)
 
         # insert the node into nodes
-        if key is None:
-            self.nodes[uuid] = node
-        else:
-            self.nodes[key] = node
+        self.file.insert_node(self.file, uuid if key is None else key, node)
+
+        # publish the update to replicas
+        self.file.publish(
+            "insert",
+            collection=None,
+            key=uuid if key is None else key,
+            id=uuid,
+            data=data,
+        )
 
         # return the node
         return node
@@ -217,16 +480,43 @@ class Database(FileOps):
                 f"name {name} not a node or collection in this database"
             )
 
+        # forget the ids of the nodes being removed
+        removed = []
+        if type in (None, "collection") and name in self.collections:
+            removed += self.collections[name].nodes.values()
+        if type in (None, "node") and name in self.nodes:
+            removed.append(self.nodes[name])
+        self.file.forget(removed)
+
         # remove from database
-        if type is None:
-            if name in self.collections:
-                del self.collections[name]
-            if name in self.nodes:
-                del self.nodes[name]
-        elif type == "collection" and name in self.collections:
-            del self.collections[name]
-        elif type == "node" and name in self.nodes:
-            del self.nodes[name]
+        if type in (None, "collection") and name in self.collections:
+            del self.file.writable(self.file, "collections")[name]
+        if type in (None, "node") and name in self.nodes:
+            del self.file.writable(self.file, "nodes")[name]
+
+        # recount views and statistics without the removed nodes
+        self.file.rebuild_trackers()
+
+        # publish the update to replicas
+        self.file.publish("remove", name=name, type=type)
+
+    def refresh(self):
+        """
+        Apply the updates other processes saved to this Database since it
+        was loaded. Writes do this automatically before they start.
+
+        Returns:
+            (bool): True if anything was loaded.
+        """
+        with self.file.write_lock:
+            return self.file.refresh()
+
+    def close(self):
+        """
+        Save any pending updates and release the files held open by this
+        Database.
+        """
+        self.file.close()
 
     def wipe(self):
         """
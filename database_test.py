@@ -2,7 +2,12 @@ import unittest
 from database import Database
 from collection import Collection
 from node import Node
+from server import Server
+from replica import Replica
+from load_generator import request
+import asyncio
 import os
+import shutil
 
 
 class DatabaseTest(unittest.TestCase):
@@ -81,8 +86,481 @@ class DatabaseTest(unittest.TestCase):
         )
         d.wipe()
 
+    def test_match(self):
+        d = Database()
+        d.wipe()
+        d.migrate("migrations/test_migration.json")
+        mary = d.collections["users"].nodes["Mary"]
+        matches = d.match(
+            "(a:users)-[:FRIENDS_WITH]->(b)-[:LIKES]->(c)", a=mary
+        )
+        self.assertEqual(
+            sorted(
+                (m["b"].data["Name"], m["c"].data["Name"]) for m in matches
+            ),
+            [
+                ("Francis", "The Beatles"),
+                ("John", "Coca-Cola"),
+                ("John", "The Beatles"),
+            ],
+        )
+        likers = list(d.match("(a:users)-[:LIKES]->(c)", c=d.nodes["Apple"]))
+        self.assertEqual(likers, [{"a": mary, "c": d.nodes["Apple"]}])
+        # statistics are kept up to date instead of being collected again
+        statistics = d.statistics
+        bob = d.collections["users"].insert({"Name": "Bob"}, key="Bob")
+        bob.relate_to(d.nodes["Apple"], by="LIKES")
+        likers = d.match("(a:users)-[:LIKES]->(c)", c=d.nodes["Apple"])
+        self.assertEqual({m["a"] for m in likers}, {mary, bob})
+        self.assertIs(d.statistics, statistics)
+        self.assertTrue(
+            d.explain("(a:users)-[:LIKES]->(c)", c=d.nodes["Apple"])
+            .startswith("start c")
+        )
+        self.assertRaisesRegex(
+            Exception, "one direction", d.match, "(a)-[:X]-(b)"
+        )
+        self.assertRaisesRegex(
+            Exception, "not a variable", d.match, "(a)", b=mary
+        )
+        d.wipe()
+
+    def test_pagination(self):
+        d = Database()
+        d.wipe()
+        col = d.add("users")
+        hub = col.insert({"name": "hub"}, key="hub")
+        with d.file.batch():
+            others = [col.insert({"n": n}, key=n) for n in range(25)]
+            for other in others:
+                label = "FOLLOWS" if other.data["n"] % 2 else "LIKES"
+                hub.relate_to(other, by=label)
+        page, cursor = hub.neighbors("LIKES", limit=5)
+        self.assertEqual([n.data["n"] for n in page], [0, 2, 4, 6, 8])
+        page, cursor = hub.neighbors("LIKES", limit=5, after=cursor)
+        self.assertEqual([n.data["n"] for n in page], [10, 12, 14, 16, 18])
+        page, cursor = hub.neighbors("LIKES", limit=5, after=cursor)
+        self.assertEqual([n.data["n"] for n in page], [20, 22, 24])
+        self.assertIsNone(cursor)
+        # pages cover every node once
+        keys, cursor = [], None
+        while True:
+            page, cursor = col.scan(limit=7, after=cursor)
+            keys += list(page)
+            if cursor is None:
+                break
+        self.assertEqual(keys, ["hub"] + list(range(25)))
+        # cursors stay valid after the nodes before them are removed
+        for n in range(10):
+            d.insert({"n": n}, key=f"node{n}")
+        page, cursor = d.scan(limit=3)
+        d.remove("node1", type="node")
+        page, cursor = d.scan(limit=3, after=cursor)
+        self.assertEqual(list(page), ["node3", "node4", "node5"])
+        matches, cursor = [], None
+        query = d.match("(a:users)-[:FOLLOWS]->(b)")
+        while True:
+            page, cursor = query.page(limit=4, after=cursor)
+            matches += [m["b"].data["n"] for m in page]
+            if cursor is None:
+                break
+        self.assertEqual(matches, list(range(1, 25, 2)))
+        # and after reloading, as sequence numbers are saved
+        page, cursor = d.scan(limit=3)
+        d.remove("node0", type="node")
+        d.remove("node2", type="node")
+        page, _ = Database().scan(limit=2, after=cursor)
+        self.assertEqual(list(page), ["node4", "node5"])
+        page, cursor = hub.neighbors("FOLLOWS", limit=2)
+        hub.unrelate(others[1])
+        reloaded = Database().collections["users"].nodes["hub"]
+        page, _ = reloaded.neighbors("FOLLOWS", limit=2, after=cursor)
+        self.assertEqual([n.data["n"] for n in page], [5, 7])
+        self.assertRaisesRegex(Exception, "positive", col.scan, 0)
+        d.wipe()
+
+    def test_materialize(self):
+        d = Database()
+        d.wipe()
+        d.migrate("migrations/test_migration.json")
+        users = d.collections["users"].nodes
+        view = d.materialize(
+            "fof", "FRIENDS_WITH", "LIKES", collection="users"
+        )
+
+        def expected(node):
+            result = {}
+            friends = node.related_by("FRIENDS_WITH")
+            for friend in friends:
+                for liked in friend.related_by("LIKES"):
+                    if liked is not node and liked not in friends:
+                        result[liked] = result.get(liked, 0) + 1
+            return result
+
+        for node in users.values():
+            self.assertEqual(view.get(node), expected(node))
+        mary = users["Mary"]
+        liked = mary.related_by("LIKES")[0]
+        others = [n for n in users.values() if n is not mary]
+        others[0].relate_to(liked, by="LIKES")
+        others[1].unrelate(others[1].related_by("FRIENDS_WITH")[0])
+        mary.unrelate(liked)
+        for node in users.values():
+            self.assertEqual(view.get(node), expected(node))
+        self.assertRaisesRegex(
+            Exception, "not related", mary.unrelate, liked
+        )
+        self.assertRaisesRegex(
+            Exception, "already exists", d.materialize, "fof", "A", "B"
+        )
+        d.drop_view("fof")
+        self.assertEqual(d.views, {})
+        d.wipe()
+
+    def test_batch(self):
+        d = Database()
+        d.wipe()
+        version = d.file.read(d.file.manifest_path)["version"]
+        with d.file.batch():
+            d.insert({"test": "data"})
+            d.insert({"test": "data"})
+            self.assertTrue(d.file.dirty)
+            self.assertEqual(
+                d.file.read(d.file.manifest_path)["version"], version
+            )
+            self.assertEqual(Database().num_nodes, 0)
+        self.assertFalse(d.file.dirty)
+        self.assertEqual(
+            d.file.read(d.file.manifest_path)["version"], version + 1
+        )
+        self.assertEqual(Database().num_nodes, 2)
+        d.wipe()
+
+    def test_refresh(self):
+        d = Database()
+        d.wipe()
+        other = Database()
+        self.assertFalse(other.refresh())
+        mary = d.insert({"name": "mary"}, key="mary")
+        self.assertTrue(other.refresh())
+        self.assertEqual(other.nodes["mary"].data, {"name": "mary"})
+        # nodes already loaded are reused when the snapshot is merged
+        loaded = other.nodes["mary"]
+        mary.relate_to(d.insert({"name": "bob"}, key="bob"), by="FRIENDS")
+        other.refresh()
+        self.assertIs(other.nodes["mary"], loaded)
+        self.assertEqual(loaded.related_by("FRIENDS"), [other.nodes["bob"]])
+        # writers apply updates they have not seen before writing
+        other.insert({"name": "sue"}, key="sue")
+        d.refresh()
+        self.assertEqual(set(d.nodes), {"mary", "bob", "sue"})
+        other.close()
+        d.wipe()
+
+    def test_lazy_open(self):
+        d = Database()
+        d.wipe()
+        d.add("users").insert({"name": "mary"}, key="mary")
+        d.insert({"name": "bob"}, key="bob")
+        lazy = Database(lazy=True)
+        self.assertTrue(lazy.file.pending)
+        self.assertEqual(lazy.num_nodes, 2)
+        # updates saved meanwhile are picked up from the manifest
+        d.insert({"name": "sue"}, key="sue")
+        self.assertFalse(lazy.refresh())
+        self.assertEqual(lazy.num_nodes, 3)
+        self.assertTrue(lazy.file.pending)
+        # writing loads the database first, so nothing is lost
+        lazy.insert({"name": "tom"}, key="tom")
+        self.assertFalse(lazy.file.pending)
+        self.assertEqual(set(lazy.nodes), {"bob", "sue", "tom"})
+        self.assertEqual(
+            lazy.collections["users"].nodes["mary"].data, {"name": "mary"}
+        )
+        lazy.close()
+        # a lookup only reads the nodes it uses
+        d.refresh()
+        d.nodes["bob"].relate_to(d.nodes["sue"], by="knows")
+        d.nodes["tom"].relate_to(d.nodes["sue"], by="knows")
+        lazy = Database(lazy=True)
+        bob, sue, tom = (lazy.nodes[key] for key in ("bob", "sue", "tom"))
+        self.assertEqual(bob.related_by("knows"), [sue])
+        self.assertEqual(sue.data, {"name": "sue"})
+        self.assertNotIn("relations", tom.__dict__)
+        # a reload fills in the nodes not read yet, while open snapshots
+        # keep seeing their relations
+        with lazy.read_snapshot() as snap:
+            d.nodes["tom"].relate_to(d.nodes["bob"], by="knows")
+            lazy.refresh()
+            self.assertEqual(lazy.file.records, None)
+            self.assertEqual(snap.relations(tom), {sue: "knows"})
+        self.assertEqual(tom.relations, {sue: "knows", bob: "knows"})
+        self.assertEqual(tom.data, {"name": "tom"})
+        lazy.close()
+        d.wipe()
+
+    def test_paged_data(self):
+        d = Database(cache_bytes=200)
+        d.wipe()
+        col = d.add("users")
+        nodes = [
+            col.insert({"n": n, "pad": "x" * 50}, key=n) for n in range(10)
+        ]
+        payloads = d.file.payloads
+        self.assertLessEqual(payloads.resident_bytes, 200)
+        self.assertGreater(payloads.evictions, 0)
+        self.assertEqual(nodes[0].data["n"], 0)
+        nodes[1].data = {"n": 100}
+        d.close()
+        d = Database()
+        self.assertIsNone(d.file.payloads)
+        self.assertEqual(d.collections["users"].nodes[1].data, {"n": 100})
+        self.assertEqual(d.collections["users"].nodes[9].data["n"], 9)
+        d.close()
+        # data of removed nodes stays while other nodes relate to them
+        d = Database(cache_bytes=200)
+        d.insert({"n": 10}, key="orphan").relate_to(
+            d.collections["users"].nodes[2], by="F"
+        )
+        d.remove("users")
+        self.assertEqual(d.nodes["orphan"].related_by("F")[0].data["n"], 2)
+        d.close()
+        d = Database()
+        self.assertEqual(d.nodes["orphan"].related_by("F")[0].data["n"], 2)
+        d.wipe()
+        for path in d.file.db_path.glob("payloads*"):
+            path.unlink()
+
+    def test_read_snapshot(self):
+        d = Database()
+        d.wipe()
+        d.migrate("migrations/test_migration.json")
+        users = d.collections["users"]
+        mary = users.nodes["Mary"]
+        with d.read_snapshot() as snap:
+            relations = snap.relations(mary)
+            extra = users.insert({"Name": "Sam"}, key="Sam")
+            mary.relate_to(extra, by="FRIENDS_WITH", bidirectional=True)
+            mary.relate_to(d.nodes["Coca-Cola"], by="LIKES")
+            d.insert({"Name": "Pepsi"}, key="Pepsi")
+            self.assertIs(snap.relations(mary), relations)
+            self.assertEqual(len(relations), 3)
+            self.assertEqual(snap.num_nodes, 6)
+            self.assertEqual(snap.num_associations, 8)
+            self.assertEqual(
+                len(snap.related_by(mary, "FRIENDS_WITH")), 2
+            )
+            self.assertNotIn(
+                d.nodes["Coca-Cola"],
+                snap.related_difference(extra, "FRIENDS_WITH", "LIKES"),
+            )
+        self.assertEqual(d.num_nodes, 8)
+        self.assertEqual(d.num_associations, 11)
+        self.assertRaisesRegex(Exception, "closed", snap.relations, mary)
+        self.assertEqual(d.file.snapshots, [])
+        d.wipe()
+
+    def test_replica(self):
+        d = Database(publish=True)
+        d.wipe()
+        d.migrate("migrations/test_migration.json")
+        r = Replica("data", "data/replica")
+        self.assertGreater(r.lag()["records"], 0)
+        r.poll()
+        self.assertEqual(r.lag()["records"], 0)
+        self.assertEqual(r.num_nodes, 6)
+        self.assertEqual(r.num_associations, 8)
+        self.assertRaisesRegex(Exception, "read only", r.insert, {"n": 1})
+
+        # a restarted replica resumes from its saved position
+        r.close()
+        d.collections["users"].nodes["Mary"].relate_to(
+            d.nodes["Coca-Cola"], by="LIKES"
+        )
+        r = Replica("data", "data/replica")
+        self.assertEqual(r.lag()["records"], 1)
+        self.assertEqual(r.poll(), 1)
+        self.assertEqual(r.num_associations, 9)
+
+        # relations to removed nodes are still replayed
+        mary = d.collections["users"].nodes["Mary"]
+        coke = d.nodes["Coca-Cola"]
+        d.remove("Coca-Cola", type="node")
+        mary.unrelate(coke)
+        coke.relate_to(mary, by="SOLD_TO")
+        self.assertEqual(r.poll(), 3)
+        replica_mary = r.collections["users"].nodes["Mary"]
+        self.assertNotIn(coke.id, [n.id for n in replica_mary.relations])
+        replica_coke = r.file.tombstones[coke.id]
+        self.assertEqual(
+            [(n.id, l) for n, l in replica_coke.relations.items()],
+            [(mary.id, "SOLD_TO")],
+        )
+        r.close()
+        d.wipe()
+        d.close()
+        shutil.rmtree("data/replica")
+        os.remove("data/changes.log")
+
+    def test_sketch(self):
+        d = Database()
+        d.wipe()
+        d.migrate("migrations/test_migration.json")
+        users = d.collections["users"]
+        mary = users.nodes["Mary"]
+        sketch = d.sketch(hops=2)
+        self.assertIs(d.sketch(hops=2), sketch)
+        # count-min sketches never undercount
+        self.assertGreaterEqual(sketch.label_count("FRIENDS_WITH"), 4)
+        self.assertGreaterEqual(sketch.degree(mary, "LIKES"), 1)
+        self.assertRaisesRegex(Exception, "hops", sketch.reachable, mary, 3)
+        mary.relate_to(d.nodes["Coca-Cola"], by="LIKES")
+        self.assertGreaterEqual(sketch.label_count("LIKES"), 5)
+        self.assertGreaterEqual(sketch.degree(mary, "LIKES"), 2)
+        scores = mary.sampled_difference("FRIENDS_WITH", "LIKES", seed=1)
+        self.assertEqual(
+            set(scores), set(mary.related_difference("FRIENDS_WITH", "LIKES"))
+        )
+
+        # hyperloglog estimates are compared on a larger graph
+        d.wipe()
+        with d.file.batch():
+            users = d.add("users")
+            nodes = [users.insert({"n": n}, key=n) for n in range(300)]
+            for n, node in enumerate(nodes):
+                for i in (1, 7, 31, 97):
+                    target = (n * i + i) % 300
+                    if target != n and nodes[target] not in node.relations:
+                        node.relate_to(nodes[target], by="AB"[target % 2])
+
+        def reachable(node, hops):
+            seen = {node}
+            frontier = [node]
+            for _ in range(hops):
+                frontier = [r for n in frontier for r in n.relations]
+                frontier = [r for r in frontier if r not in seen]
+                seen.update(frontier)
+            return len(seen) - 1
+
+        def assert_close(estimate, exact, tolerance):
+            self.assertLessEqual(abs(estimate - exact), exact * tolerance)
+
+        def rebuilt(sketch):
+            sketch.reachable(nodes[0])
+            if sketch.thread is not None:
+                sketch.thread.join()
+            return sketch
+
+        # the sketch from before the wipe is rebuilt right away
+        sketch = rebuilt(d.sketch(hops=2, max_age=0))
+        for hops in (1, 2):
+            assert_close(
+                sum(sketch.reachable(n, hops) for n in nodes),
+                sum(reachable(n, hops) for n in nodes),
+                0.1,
+            )
+        targets = {r for n in nodes for r, l in n.relations.items()}
+        assert_close(
+            sketch.distinct_targets("A"),
+            len([r for r in targets if r.data["n"] % 2 == 0]),
+            0.25,
+        )
+        # counts follow writes, neighborhoods are rebuilt in the background
+        for target in nodes[100:140]:
+            if target not in nodes[0].relations:
+                nodes[0].relate_to(target, by="A")
+        self.assertGreaterEqual(sketch.degree(nodes[0], "A"), 40)
+        rebuilt(sketch)
+        assert_close(
+            sketch.reachable(nodes[0], 1), reachable(nodes[0], 1), 0.25
+        )
+        assert_close(
+            sum(sketch.reachable(n) for n in nodes),
+            sum(reachable(n, 2) for n in nodes),
+            0.1,
+        )
+        d.wipe()
+
+    def test_server(self):
+        d = Database()
+        d.wipe()
+
+        async def run():
+            server = Server(d, port=0)
+            await server.start()
+            reader, writer = await asyncio.open_connection(
+                "127.0.0.1", server.port
+            )
+            results = [
+                await request(reader, writer, "POST", "/nodes",
+                              {"key": "a", "data": {"n": 1}}),
+                await request(reader, writer, "GET", "/nodes/a"),
+                await request(reader, writer, "GET", "/nodes/b"),
+                await request(reader, writer, "POST", "/find", {"n": 1}),
+                await request(reader, writer, "GET", "/find?n=1"),
+                await request(reader, writer, "POST", "/match?limit=1",
+                              {"pattern": "(a)"}),
+                await request(reader, writer, "GET", "/scan?limit=x"),
+                # malformed arguments are answered with 400
+                await request(reader, writer, "POST", "/find", [1, 2]),
+                await request(reader, writer, "POST", "/relations",
+                              {"from": "a", "to": {"key": "a"}}),
+                await request(reader, writer, "POST", "/match?bindings=a",
+                              {"pattern": "(a)"}),
+                await request(reader, writer, "POST", "/match",
+                              {"pattern": "(a)", "bindings": {"a": 1}}),
+                await request(reader, writer, "POST", "/neighbors",
+                              {"key": ["a"], "label": "x"}),
+                await request(reader, writer, "POST", "/neighbors",
+                              {"key": "a", "label": {"x": 1}}),
+                await request(reader, writer, "POST", "/nodes",
+                              {"key": {"k": 1}, "data": {}}),
+                await request(reader, writer, "POST", "/relations",
+                              {"from": {"key": "a"}, "to": {"key": "a"},
+                               "by": [1]}),
+            ]
+            writer.write(b"GET /scan HTTP/1.1\r\nContent-Length: x\r\n\r\n")
+            invalid = await reader.readuntil(b"\r\n\r\n")
+            # idle connections are closed when the server stops
+            idle_reader, idle = await asyncio.open_connection(
+                "127.0.0.1", server.port
+            )
+            await request(idle_reader, idle, "GET", "/nodes/a")
+            await server.stop()
+            closed = await idle_reader.read()
+            writer.close()
+            idle.close()
+            return results, invalid, closed
+
+        results, invalid, closed = asyncio.run(run())
+
+        created, found, missing, typed, text, matched, limit = results[:7]
+        self.assertEqual([r[0] for r in results[7:]], [400] * 8)
+        self.assertEqual(created, (201, {"key": "a", "collection": None,
+                                         "data": {"n": 1}}))
+        self.assertEqual(found[1]["data"], {"n": 1})
+        self.assertEqual(missing[0], 404)
+        self.assertEqual(typed, (200, [created[1]]))
+        self.assertEqual(text, (200, [created[1]]))
+        self.assertEqual(len(matched[1]), 1)
+        self.assertEqual(limit[0], 400)
+        self.assertTrue(invalid.startswith(b"HTTP/1.1 400"))
+        self.assertEqual(closed, b"")
+        d.wipe()
+
     def test_relate_to(self):
-        pass
+        d = Database()
+        d.wipe()
+        a = d.insert({"n": 1}, key="a")
+        b = d.insert({"n": 2}, key="b")
+        a.relate_to(b, by=("since", 2019))
+        self.assertEqual(a.related_by(("since", 2019)), [b])
+        self.assertRaisesRegex(
+            Exception, "hashable", b.relate_to, a, by={"since": 2019}
+        )
+        self.assertRaisesRegex(Exception, "hashable", b.relate_to, a, by=[1])
+        self.assertEqual(b.relations, {})
+        d.wipe()
 
     def test_related_by(self):
         pass
@@ -0,0 +1,144 @@
+import asyncio
+import json
+from random import choice, random
+from time import perf_counter as timer
+
+
+async def request(reader, writer, method, path, body=None):
+    """
+    Send one request on a keep-alive connection and read its response.
+
+    Returns:
+        (tuple): The status code and decoded JSON body of the response.
+    """
+    data = json.dumps(body).encode() if body is not None else b""
+    writer.write(
+        (
+            f"{method} {path} HTTP/1.1\r\n"
+            "Host: localhost\r\n"
+            f"Content-Length: {len(data)}\r\n\r\n"
+        ).encode()
+        + data
+    )
+    await writer.drain()
+    head = (await reader.readuntil(b"\r\n\r\n")).decode("latin-1")
+    status = int(head.split(" ", 2)[1])
+    length = 0
+    for line in head.split("\r\n")[1:]:
+        if line.lower().startswith("content-length:"):
+            length = int(line.split(":", 1)[1])
+    payload = await reader.readexactly(length)
+    return status, json.loads(payload)
+
+
+async def worker(host, port, keys, deadline, write_ratio, latencies, errors):
+    """
+    Issue requests over one connection until deadline, recording latencies.
+    """
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        while timer() < deadline:
+            a, b = choice(keys), choice(keys)
+            start = timer()
+            if random() < write_ratio:
+                status, _ = await request(
+                    reader,
+                    writer,
+                    "POST",
+                    "/relations",
+                    {
+                        "from": {"key": a, "collection": "users"},
+                        "to": {"key": b, "collection": "users"},
+                        "by": "FRIENDS_WITH",
+                    },
+                )
+            else:
+                status, _ = await request(
+                    reader,
+                    writer,
+                    "GET",
+                    "/related_difference?collection=users&key="
+                    f"{a}&label_1=FRIENDS_WITH&label_2=FRIENDS_WITH",
+                )
+            latencies.append(timer() - start)
+            # a duplicate relation is an expected client error
+            if status >= 500:
+                errors.append(status)
+    finally:
+        writer.close()
+
+
+async def main(host, port, connections, duration, nodes, write_ratio):
+    """
+    Seed a users collection and then measure requests/s and tail latency.
+    """
+    reader, writer = await asyncio.open_connection(host, port)
+    await request(reader, writer, "POST", "/collections", {"name": "users"})
+    keys = []
+    for n in range(nodes):
+        await request(
+            reader,
+            writer,
+            "POST",
+            "/nodes",
+            {"collection": "users", "key": f"user{n}", "data": {"num": n}},
+        )
+        keys.append(f"user{n}")
+    writer.close()
+
+    latencies = []
+    errors = []
+    start = timer()
+    await asyncio.gather(
+        *(
+            worker(
+                host,
+                port,
+                keys,
+                start + duration,
+                write_ratio,
+                latencies,
+                errors,
+            )
+            for _ in range(connections)
+        )
+    )
+    elapsed = timer() - start
+
+    latencies.sort()
+
+    def percentile(p):
+        return latencies[min(int(len(latencies) * p), len(latencies) - 1)]
+
+    print(f"requests: {len(latencies)} in {elapsed:.2f}s")
+    print(f"throughput: {len(latencies) / elapsed:.0f} requests/s")
+    for p in (0.5, 0.95, 0.99):
+        print(f"p{int(p * 100)}: {percentile(p) * 1000:.2f}ms")
+    print(f"max: {latencies[-1] * 1000:.2f}ms")
+    print(f"server errors: {len(errors)}")
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description="Generate load against a local GrapevineDB server."
+    )
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--connections", type=int, default=16)
+    parser.add_argument("--duration", type=float, default=10.0)
+    parser.add_argument("--nodes", type=int, default=200)
+    parser.add_argument("--write-ratio", type=float, default=0.2)
+    args = parser.parse_args()
+
+    asyncio.run(
+        main(
+            args.host,
+            args.port,
+            args.connections,
+            args.duration,
+            args.nodes,
+            args.write_ratio,
+        )
+    )
@@ -1,5 +1,6 @@
-from queue import SimpleQueue
+from random import Random
 from file_ops import FileOps
+from ordered import OrderedIndex
 
 
 class Node(FileOps):
@@ -19,9 +20,70 @@ class Node(FileOps):
             (Node): The initialized Node object.
         """
         self.id = uuid
-        self.data = data
-        self.relations = {}
+        self._data = None
+        # relations are grouped by label so each label can be paged through
+        self.relations = OrderedIndex(by_value=True)
         self.file = file
+        self.data = data
+
+    def __getstate__(self):
+        """
+        Return the state of this Node to be pickled. When payloads are paged
+        out to disk, data is left out and kept in the payload store.
+
+        Returns:
+            (dict): The state of this Node.
+        """
+        state = self.__dict__.copy()
+        if getattr(self.file, "payloads", None) is not None:
+            state["_data"] = None
+        return state
+
+    def __setstate__(self, state):
+        """
+        Restore the state of this Node from a pickle, including pickles
+        written before data was a property or relations were ordered.
+
+        Args:
+            state (dict): The state of the Node.
+        """
+        if "data" in state:
+            state["_data"] = state.pop("data")
+        if not isinstance(state.get("relations"), OrderedIndex):
+            state["relations"] = OrderedIndex(
+                state.get("relations", {}), by_value=True
+            )
+        self.__dict__.update(state)
+
+    @property
+    def data(self):
+        """
+        Return the data of this Node. When payloads are paged out to disk the
+        data is loaded through the payload cache, so changes made in place
+        should be followed by assigning data back to the Node.
+
+        Returns:
+            (dict): The data of this Node.
+        """
+        payloads = getattr(self.file, "payloads", None)
+        if payloads is None:
+            return self._data
+        return payloads.get(self.id)
+
+    @data.setter
+    def data(self, data):
+        """
+        Set the data of this Node.
+
+        Args:
+            data (dict): The data to assign to this Node.
+        """
+        payloads = getattr(self.file, "payloads", None)
+        if payloads is None:
+            self._data = data
+        else:
+            payloads.put(self.id, data)
+            self._data = None
 
     def __str__(self):
         """
@@ -51,18 +113,25 @@ class Node(FileOps):
         Args:
             node (Node): The other Node object to create a relation to.
             by (any|None): The label to assign to the newly established
-            relation.
+            relation. Relations are grouped by label, so it must be hashable.
             bidirectional (bool|False): If True, the relation will be created
             both ways (from this Node to node and from node to this Node).
 
         Raises:
             Exception: If node is not of type Node.
+            Exception: If by is not hashable.
             Exception: If specified relation already exists on this Node.
         """
         # node must be of type Node
         if not isinstance(node, Node):
             raise Exception("node must be a node object")
 
+        # label must be hashable
+        try:
+            hash(by)
+        except TypeError:
+            raise Exception("by must be hashable, such as a str or tuple")
+
         # edge must not already exist
         if node in self.relations:
             raise Exception(
@@ -78,25 +147,97 @@ class Node(FileOps):
             )
 
         # add edge to node
-        self.relations[node] = by
+        self.file.link(self, node, by)
         if bidirectional:
-            node.relations[self] = by
+            self.file.link(node, self, by)
+
+        # publish the update to replicas
+        self.file.publish(
+            "relate",
+            source=self.id,
+            target=node.id,
+            by=by,
+            bidirectional=bidirectional,
+        )
+
+    @FileOps.save_on_update
+    def unrelate(self, node, bidirectional=False):
+        """
+        Remove the relation from this Node to another Node object.
 
-    def related_by(self, label):
+        Args:
+            node (Node): The other Node object to remove the relation to.
+            bidirectional (bool|False): If True, the relation from node to
+            this Node is removed as well.
+
+        Raises:
+            Exception: If node is not of type Node.
+            Exception: If a relation to remove does not exist.
+        """
+        # node must be of type Node
+        if not isinstance(node, Node):
+            raise Exception("node must be a node object")
+
+        # edge must exist
+        if node not in self.relations:
+            raise Exception(f"{self.id} is not related to {node.id}")
+        if bidirectional and self not in node.relations:
+            raise Exception(f"{node.id} is not related to {self.id}")
+
+        # remove edge from node
+        self.file.unlink(self, node)
+        if bidirectional:
+            self.file.unlink(node, self)
+
+        # publish the update to replicas
+        self.file.publish(
+            "unrelate",
+            source=self.id,
+            target=node.id,
+            bidirectional=bidirectional,
+        )
+
+    def related_by(self, label, snapshot=None):
         """
         Return a list of nodes related to this Node by
         label.
 
         Args:
             label (any): The label of the relation to search for.
+            snapshot (Snapshot|None): If specified, the Snapshot to read.
 
         Returns:
             (list): List of Node objects related to this Node by label.
         """
+        view = getattr if snapshot is None else snapshot.view
+
+        return [n for n, l in view(self, "relations").items() if l == label]
+
+    def neighbors(self, label, limit=100, after=None, snapshot=None):
+        """
+        Return a page of the nodes related to this Node by label, in the
+        order the relations were created. Each page costs O(limit), so hub
+        nodes can be paged through without building the whole list.
 
-        return [n for n, l in self.relations.items() if l == label]
+        Args:
+            label (any): The label of the relations to page through.
+            limit (int): The maximum number of nodes to return.
+            after (int|None): The cursor returned with the previous page, or
+            None for the first page.
+            snapshot (Snapshot|None): If specified, the Snapshot to read.
 
-    def related_difference(self, label_1, label_2):
+        Returns:
+            (tuple): The list of related Node objects and the cursor of the
+            next page, which is None when there are no more nodes.
+
+        Raises:
+            Exception: If limit is not a positive int.
+        """
+        view = getattr if snapshot is None else snapshot.view
+
+        return view(self, "relations").page(limit, after, group=label)
+
+    def related_difference(self, label_1, label_2, snapshot=None):
         """
         Return a dict of nodes that are directly related by label_1
         and indirectly related by label_2. The value will be the
@@ -106,7 +247,8 @@ class Node(FileOps):
             label_1 (any): The label of the direct relation to this Node.
             label_2 (any): The label of the indirect relations to find
             that are connected to this Node.
-        
+            snapshot (Snapshot|None): If specified, the Snapshot to read.
+
         Returns:
             (dict): A dict of Node(s) that are indirectly related by label_2
             and directly related by label_1. The value corresponding to each
@@ -114,9 +256,11 @@ class Node(FileOps):
             relation).
         """
 
+        view = getattr if snapshot is None else snapshot.view
+
         # build stack of nodes related to current
         # node by label_1
-        stack = [n for n, l in self.relations.items() if l == label_1]
+        stack = [n for n, l in view(self, "relations").items() if l == label_1]
 
         # if stack is empty, no direct relation by label_1 exists,
         # return empty list
@@ -137,7 +281,7 @@ class Node(FileOps):
                 # mark it as visited
                 visited.add(node)
                 # iterate through its relations
-                for relation, label in node.relations.items():
+                for relation, label in view(node, "relations").items():
                     # add each relation to the stack
                     stack.append(relation)
                     # if the label is equal to label_2, add the node to result
@@ -149,3 +293,56 @@ class Node(FileOps):
 
         # return resulting list of nodes
         return result
+
+    def sampled_difference(
+        self, label_1, label_2, walks=1000, depth=4, seed=None
+    ):
+        """
+        Estimate related_difference with random walks instead of a full
+        traversal. Each walk starts at a random Node related to this Node by
+        label_1 and follows up to depth random relations, scoring the target
+        of every label_2 relation it takes. Like personalized PageRank, the
+        scores favour candidates close to this Node, and they cost
+        O(walks * depth) regardless of how many Nodes are reachable.
+
+        Args:
+            label_1 (any): The label of the direct relation to this Node.
+            label_2 (any): The label of the indirect relations to score.
+            walks (int): The number of random walks, more walks give more
+            accurate scores.
+            depth (int): The maximum number of relations followed per walk.
+            seed (any|None): If specified, the seed of the random walks.
+
+        Returns:
+            (dict): A dict of Node(s) indirectly related by label_2 to the
+            number of walks that reached them.
+        """
+        rng = Random(seed)
+
+        # nodes related to this node by label_1 start the walks
+        starts = [n for n, l in self.relations.items() if l == label_1]
+        if len(starts) == 0:
+            return {}
+
+        # create needed structures
+        result = {}
+        direct_relations = set([self] + starts)
+        edges = {}
+
+        for _ in range(walks):
+            node = rng.choice(starts)
+            for _ in range(depth):
+                # list relations once per node, then pick in O(1)
+                if node not in edges:
+                    edges[node] = list(node.relations.items())
+                if not edges[node]:
+                    break
+                node, label = rng.choice(edges[node])
+                # like related_difference, do not walk back through self
+                if node is self:
+                    break
+                if label == label_2 and node not in direct_relations:
+                    result[node] = result.get(node, 0) + 1
+
+        # return resulting scores of nodes
+        return result
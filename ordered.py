@@ -0,0 +1,315 @@
+from bisect import bisect_right
+from threading import RLock
+
+# placeholder for a key that was removed from its group
+REMOVED = object()
+
+# readers build groups on first use, so building them and updating an
+# OrderedIndex without groups take turns
+INDEXING = RLock()
+
+
+class OrderedIndex(dict):
+    """
+    An OrderedIndex is a dict that also keeps its keys in insertion order,
+    optionally grouped by value, with a sequence number for each key.
+    Sequence numbers are never reused and are saved with the keys, so they
+    make stable cursors: paging through a group after a sequence number
+    costs O(log n + page size) no matter how many keys were added or
+    removed since, even in another process. The groups are only built the
+    first time they are paged through or a key is removed. Until then the
+    sequence number of each key is its position, and an OrderedIndex costs
+    no more than a dict.
+    """
+
+    def __init__(self, items=(), by_value=False, order=None):
+        """
+        Initialize an OrderedIndex.
+
+        Args:
+            items (dict|iterable): The initial items, in order.
+            by_value (bool): If True, keys are grouped by their value so each
+            value can be paged through on its own, otherwise all keys are in
+            the group None.
+            order (tuple|None): The sequence numbers of items, as returned
+            by order.
+
+        Returns:
+            (OrderedIndex): The initialized OrderedIndex object.
+        """
+        super().__init__(items)
+        self.by_value = by_value
+        self.next_seq = 0
+        # group -> [sequence numbers, keys] in insertion order, None until
+        # the groups are first used
+        self.groups = None
+        # key -> sequence number
+        self.positions = None
+        # group -> number of removed keys not yet compacted
+        self.removed = None
+        if order is not None:
+            self._index(order)
+
+    def __reduce__(self):
+        """
+        Pickle an OrderedIndex as its items and sequence numbers.
+
+        Returns:
+            (tuple): The callable and arguments that rebuild it.
+        """
+        return (
+            OrderedIndex,
+            (list(self.items()), self.by_value, self.order()),
+        )
+
+    def __setitem__(self, key, value):
+        if self.groups is None:
+            # appending keeps the sequence number of each key its position,
+            # moving a key to another group does not
+            with INDEXING:
+                if self.groups is None and (
+                    key not in self or not self.by_value or self[key] == value
+                ):
+                    super().__setitem__(key, value)
+                    return
+            self._index()
+        if key in self:
+            if not self.by_value or self[key] == value:
+                super().__setitem__(key, value)
+                return
+            self._unlink(key, self[key])
+        super().__setitem__(key, value)
+        self._link(key, value)
+
+    def __delitem__(self, key):
+        # removing a key changes the positions of the keys after it
+        if self.groups is None and key in self:
+            self._index()
+        if self.groups is not None:
+            self._unlink(key, self[key])
+        super().__delitem__(key)
+
+    def pop(self, key, *default):
+        if key not in self:
+            return super().pop(key, *default)
+        if self.groups is None:
+            self._index()
+        value = super().pop(key)
+        self._unlink(key, value)
+        return value
+
+    def popitem(self):
+        if self.groups is None and self:
+            self._index()
+        key, value = super().popitem()
+        self._unlink(key, value)
+        return key, value
+
+    def setdefault(self, key, default=None):
+        if key not in self:
+            self[key] = default
+        return self[key]
+
+    def update(self, *args, **kwargs):
+        with INDEXING:
+            if self.groups is None and not self:
+                super().update(*args, **kwargs)
+                return
+        for key, value in dict(*args, **kwargs).items():
+            self[key] = value
+
+    def clear(self):
+        # sequence numbers handed out before are not reused
+        if self.groups is None and self:
+            self._index()
+        super().clear()
+        if self.groups is not None:
+            self.groups = {}
+            self.positions = {}
+            self.removed = {}
+
+    def reset(self, items, order=None):
+        """
+        Replace the items and sequence numbers, such as with ones loaded
+        from a snapshot.
+
+        Args:
+            items (dict): The items, in order.
+            order (tuple|None): The sequence numbers of items, as returned
+            by order.
+        """
+        with INDEXING:
+            super().clear()
+            super().update(items)
+            self.next_seq = 0
+            self.groups = None
+            self.positions = None
+            self.removed = None
+            if order is not None:
+                self._index(order)
+
+    def order(self):
+        """
+        Return the sequence numbers of the keys, to be saved with them.
+
+        Returns:
+            (tuple|None): The next sequence number and the sequence number
+            of each key in order, or None if each key's sequence number is
+            its position.
+        """
+        if self.groups is None:
+            return None
+        seqs = [self.positions[key] for key in self]
+        if self.next_seq == len(seqs) and seqs == list(range(len(seqs))):
+            return None
+        return self.next_seq, seqs
+
+    def copy(self):
+        """
+        Return a copy of this OrderedIndex with the same sequence numbers.
+
+        Returns:
+            (OrderedIndex): The copy.
+        """
+        copy = OrderedIndex(self, by_value=self.by_value)
+        # groups are published last, so positions are set once it is
+        groups = self.groups
+        if groups is not None:
+            copy.next_seq = self.next_seq
+            copy.groups = {
+                group: [list(seqs), list(keys)]
+                for group, (seqs, keys) in groups.items()
+            }
+            copy.positions = dict(self.positions)
+            copy.removed = dict(self.removed)
+        return copy
+
+    def _index(self, order=None):
+        """
+        Build the groups from the keys in insertion order.
+
+        Args:
+            order (tuple|None): The sequence numbers of the keys, as
+            returned by order, otherwise each key's sequence number is its
+            position.
+        """
+        with INDEXING:
+            # another reader may have built them meanwhile
+            if self.groups is not None and order is None:
+                return
+            items = list(dict.items(self))
+            if order is None:
+                next_seq, seqs = len(items), range(len(items))
+            else:
+                next_seq, seqs = order
+                items = [item for _, item in sorted(zip(seqs, items))]
+                seqs = sorted(seqs)
+            # build into locals and publish groups last, so copy never
+            # sees groups without positions
+            groups = {}
+            positions = {}
+            for seq, (key, value) in zip(seqs, items):
+                group = value if self.by_value else None
+                if group not in groups:
+                    groups[group] = [[], []]
+                groups[group][0].append(seq)
+                groups[group][1].append(key)
+                positions[key] = seq
+            self.positions = positions
+            self.removed = {}
+            self.next_seq = next_seq
+            self.groups = groups
+
+    def _link(self, key, value):
+        """
+        Append key to the end of its group.
+
+        Args:
+            key (any): The key to add.
+            value (any): The value of the key.
+        """
+        group = value if self.by_value else None
+        if group not in self.groups:
+            self.groups[group] = [[], []]
+        seqs, keys = self.groups[group]
+        seqs.append(self.next_seq)
+        keys.append(key)
+        self.positions[key] = self.next_seq
+        self.next_seq += 1
+
+    def _unlink(self, key, value):
+        """
+        Remove key from its group, compacting the group once half of it is
+        removed keys.
+
+        Args:
+            key (any): The key to remove.
+            value (any): The value of the key.
+        """
+        group = value if self.by_value else None
+        seq = self.positions.pop(key)
+        seqs, keys = self.groups[group]
+        keys[bisect_right(seqs, seq) - 1] = REMOVED
+        self.removed[group] = self.removed.get(group, 0) + 1
+        if self.removed[group] * 2 >= len(keys):
+            live = [(s, k) for s, k in zip(seqs, keys) if k is not REMOVED]
+            if live:
+                self.groups[group] = [list(i) for i in zip(*live)]
+            else:
+                del self.groups[group]
+            del self.removed[group]
+
+    def iter_from(self, after=None, group=None):
+        """
+        Yield the keys of a group in insertion order.
+
+        Args:
+            after (int|None): If specified, only keys with a greater sequence
+            number are yielded.
+            group (any): The group to iterate over, the value of the keys
+            when grouped by value.
+
+        Yields:
+            (tuple): The sequence number and key of each key.
+        """
+        if self.groups is None:
+            self._index()
+        if group not in self.groups:
+            return
+        seqs, keys = self.groups[group]
+        start = 0 if after is None else bisect_right(seqs, after)
+        for i in range(start, len(keys)):
+            if keys[i] is not REMOVED:
+                yield seqs[i], keys[i]
+
+    def page(self, limit, after=None, group=None):
+        """
+        Return the next page of keys of a group.
+
+        Args:
+            limit (int): The maximum number of keys to return.
+            after (int|None): The cursor returned with the previous page, or
+            None for the first page.
+            group (any): The group to page through.
+
+        Returns:
+            (tuple): The list of keys and the cursor of the next page, which
+            is None when there are no more keys.
+
+        Raises:
+            Exception: If limit is not a positive int.
+        """
+
+        # limit must be a positive int
+        if not isinstance(limit, int) or limit < 1:
+            raise Exception("limit must be a positive int")
+
+        keys = []
+        cursor = None
+        for seq, key in self.iter_from(after, group):
+            if len(keys) == limit:
+                # there is at least one more key
+                return keys, cursor
+            keys.append(key)
+            cursor = seq
+        return keys, None
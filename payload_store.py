@@ -0,0 +1,152 @@
+import dbm
+from pickle import dumps, loads
+from collections import OrderedDict
+
+
+class PayloadStore:
+    """
+    PayloadStore keeps Node data dicts in an on-disk key-value file and
+    holds recently used ones in an LRU cache bounded by a byte budget.
+    """
+
+    def __init__(self, path, cache_bytes):
+        """
+        Initialize a PayloadStore.
+
+        Args:
+            path (Path): The path of the key-value file.
+            cache_bytes (int): The maximum number of pickled bytes held in
+            memory at once.
+
+        Returns:
+            (PayloadStore): The initialized PayloadStore object.
+
+        Raises:
+            Exception: If cache_bytes is not a non-negative int.
+        """
+
+        # cache_bytes must be a non-negative int
+        if not isinstance(cache_bytes, int) or cache_bytes < 0:
+            raise Exception("cache_bytes must be a non-negative int")
+
+        self.path = path
+        self.cache_bytes = cache_bytes
+        self.db = dbm.open(str(path), "c")
+        # key -> [data, size in bytes, hash of the bytes last written]
+        self.cache = OrderedDict()
+        self.resident_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __contains__(self, key):
+        """
+        Return whether key has a payload in this PayloadStore.
+
+        Returns:
+            (bool): True if key is cached or on disk.
+        """
+        return key in self.cache or key.encode() in self.db
+
+    @staticmethod
+    def exists(path):
+        """
+        Return whether a key-value file exists at path.
+
+        Returns:
+            (bool): True if a key-value file exists at path.
+        """
+        return bool(dbm.whichdb(str(path)))
+
+    def get(self, key):
+        """
+        Return the payload for key, loading it from disk on a cache miss.
+
+        Args:
+            key (str): The id of the Node the payload belongs to.
+
+        Returns:
+            (dict): The payload.
+
+        Raises:
+            KeyError: If key has no payload.
+        """
+        if key in self.cache:
+            self.hits += 1
+            self.cache.move_to_end(key)
+            return self.cache[key][0]
+
+        self.misses += 1
+        raw = self.db[key.encode()]
+        data = loads(raw)
+        self._admit(key, data, len(raw), hash(raw))
+        return data
+
+    def put(self, key, data):
+        """
+        Set the payload for key. The payload is written to disk when it is
+        evicted or the store is flushed.
+
+        Args:
+            key (str): The id of the Node the payload belongs to.
+            data (dict): The payload.
+        """
+        raw = dumps(data)
+        if key in self.cache:
+            self.resident_bytes -= self.cache.pop(key)[1]
+        # a digest of None is never equal, so the entry is always written
+        self._admit(key, data, len(raw), None)
+
+    def delete(self, key):
+        """
+        Remove the payload for key if it exists.
+
+        Args:
+            key (str): The id of the Node the payload belongs to.
+        """
+        if key in self.cache:
+            self.resident_bytes -= self.cache.pop(key)[1]
+        if key.encode() in self.db:
+            del self.db[key.encode()]
+
+    def flush(self):
+        """
+        Write every changed cached payload to disk.
+        """
+        for key, entry in self.cache.items():
+            self._write_back(key, entry)
+        sync = getattr(self.db, "sync", None)
+        if sync is not None:
+            sync()
+
+    def close(self):
+        """
+        Flush changed payloads and close the key-value file.
+        """
+        self.flush()
+        self.cache.clear()
+        self.resident_bytes = 0
+        self.db.close()
+
+    def _admit(self, key, data, size, digest):
+        """
+        Add an entry to the cache and evict least recently used entries
+        until the cache fits its budget again.
+        """
+        self.cache[key] = [data, size, digest]
+        self.resident_bytes += size
+        while self.resident_bytes > self.cache_bytes and len(self.cache) > 1:
+            old_key, entry = self.cache.popitem(last=False)
+            self.resident_bytes -= entry[1]
+            self.evictions += 1
+            self._write_back(old_key, entry)
+
+    def _write_back(self, key, entry):
+        """
+        Write an entry to disk if it changed since it was last written. Dicts
+        may be changed in place, so entries are compared by their bytes.
+        """
+        raw = dumps(entry[0])
+        if hash(raw) != entry[2]:
+            self.db[key.encode()] = raw
+            entry[2] = hash(raw)
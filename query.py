@@ -0,0 +1,550 @@
+import re
+from node import Node
+
+
+# a node in a pattern, e.g. (a), (a:users) or (:users)
+NODE_PATTERN = re.compile(r"\((\w*)(?::(\w+))?\)")
+
+# an edge in a pattern, e.g. -[:LIKES]->, <-[:LIKES]- or -[]->
+EDGE_PATTERN = re.compile(r"(<?)-\[(?::(\w+))?\]-(>?)")
+
+
+class Pattern:
+    """
+    A Pattern is a parsed path pattern made of node variables joined by
+    labeled, directed edges, e.g. (a:users)-[:FRIENDS_WITH]->(b).
+    """
+
+    def __init__(self, text):
+        """
+        Parse a pattern string into variables and edges.
+
+        Args:
+            text (str): The pattern to parse.
+
+        Returns:
+            (Pattern): The parsed Pattern object.
+
+        Raises:
+            Exception: If text is not of type str.
+            Exception: If text is not a valid pattern.
+        """
+
+        # pattern must be a string
+        if not isinstance(text, str):
+            raise Exception("pattern must be of type str")
+
+        self.text = text
+        # list of (variable, collection name or None) in path order
+        self.variables = []
+        # list of (label or None, forward) where forward is True when the
+        # edge points from variables[i] to variables[i + 1]
+        self.edges = []
+
+        # whitespace is insignificant, drop it before matching tokens
+        rest = re.sub(r"\s+", "", text)
+        pos = self._parse_node(rest, 0)
+        while pos < len(rest):
+            match = EDGE_PATTERN.match(rest, pos)
+            if match is None:
+                raise Exception(f"invalid edge in pattern at {rest[pos:]!r}")
+            left, label, right = match.groups()
+            if bool(left) == bool(right):
+                raise Exception(
+                    f"edge {match.group(0)!r} must have exactly one direction"
+                )
+            self.edges.append((label, bool(right)))
+            pos = self._parse_node(rest, match.end())
+
+    def __str__(self):
+        """
+        Return the str representation of this Pattern.
+
+        Returns:
+            (str): The pattern text this Pattern was parsed from.
+        """
+        return self.text
+
+    def _parse_node(self, text, pos):
+        """
+        Parse a node at pos in text and append it to variables.
+
+        Returns:
+            (int): The position in text after the parsed node.
+
+        Raises:
+            Exception: If there is no valid node at pos.
+        """
+        match = NODE_PATTERN.match(text, pos)
+        if match is None:
+            raise Exception(f"invalid node in pattern at {text[pos:]!r}")
+        name, collection = match.groups()
+
+        # anonymous nodes get a private variable name
+        if not name:
+            name = f"_{len(self.variables)}"
+
+        self.variables.append((name, collection))
+        return match.end()
+
+
+class Statistics:
+    """
+    Statistics holds label and degree counts for a Database along with the
+    reverse adjacency needed to expand edges against their direction. They
+    are kept up to date as Nodes are inserted and related, so only removing
+    Nodes rescans the Database.
+    """
+
+    def __init__(self, file):
+        """
+        Collect statistics by scanning every Node in file once.
+
+        Args:
+            file (FileOps): The FileOps object of the Database.
+
+        Returns:
+            (Statistics): The initialized Statistics object.
+        """
+        self.file = file
+        self.rebuild()
+
+    def rebuild(self):
+        """
+        Recount the statistics from every Node in the Database, used when
+        they are created and after Nodes are removed or reloaded.
+        """
+        # collection name of each node, None for top level nodes
+        self.membership = {}
+        # number of nodes in each collection
+        self.collection_sizes = {}
+        # number of edges, distinct sources and distinct targets per label
+        self.edge_counts = {}
+        self.source_counts = {}
+        self.target_counts = {}
+        # node -> label -> number of edges from and to the node
+        self.outgoing_labels = {}
+        self.incoming_labels = {}
+        # node -> source -> label of each edge pointing at the node
+        self.incoming = {}
+
+        for node in self.file.nodes.values():
+            self.membership[node] = None
+        for name, collection in self.file.collections.items():
+            self.collection_sizes[name] = len(collection.nodes)
+            for node in collection.nodes.values():
+                self.membership[node] = name
+
+        for node in self.membership:
+            for relation, label in node.relations.items():
+                self.link(node, relation, label)
+
+    def insert(self, owner, node):
+        """
+        Count a Node that was inserted.
+
+        Args:
+            owner (object): The Database file or Collection node was
+            inserted into.
+            node (Node): The inserted Node.
+        """
+        name = getattr(owner, "name", None)
+        self.membership[node] = name
+        if name is not None:
+            self.collection_sizes[name] = (
+                self.collection_sizes.get(name, 0) + 1
+            )
+
+    def link(self, source, target, label):
+        """
+        Count a relation that was created. Relations from removed Nodes
+        are not counted.
+
+        Args:
+            source (Node): The Node the relation is from.
+            target (Node): The Node the relation is to.
+            label (any): The label of the relation.
+        """
+        if source not in self.membership:
+            return
+        self.edge_counts[label] = self.edge_counts.get(label, 0) + 1
+        if self._add(self.outgoing_labels, source, label, 1):
+            self.source_counts[label] = self.source_counts.get(label, 0) + 1
+        if self._add(self.incoming_labels, target, label, 1):
+            self.target_counts[label] = self.target_counts.get(label, 0) + 1
+        self.incoming.setdefault(target, {})[source] = label
+
+    def unlink(self, source, target, label):
+        """
+        Uncount a relation that was removed.
+
+        Args:
+            source (Node): The Node the relation was from.
+            target (Node): The Node the relation was to.
+            label (any): The label of the relation.
+        """
+        if source not in self.membership:
+            return
+        self._add(self.edge_counts, label, None, -1)
+        if self._add(self.outgoing_labels, source, label, -1):
+            self._add(self.source_counts, label, None, -1)
+        if self._add(self.incoming_labels, target, label, -1):
+            self._add(self.target_counts, label, None, -1)
+        sources = self.incoming[target]
+        del sources[source]
+        if not sources:
+            del self.incoming[target]
+
+    def _add(self, counts, key, label, count):
+        """
+        Add count to counts[key], or to counts[key][label] if label is not
+        None, dropping counts that reach 0.
+
+        Returns:
+            (bool): True if the count changed from or to 0.
+        """
+        if label is not None:
+            labels = counts.setdefault(key, {})
+            changed = self._add(labels, label, None, count)
+            if not labels:
+                del counts[key]
+            return changed
+        counts[key] = counts.get(key, 0) + count
+        if not counts[key]:
+            del counts[key]
+            return True
+        return counts[key] == count
+
+    @property
+    def num_nodes(self):
+        """
+        Return the number of nodes counted by these Statistics.
+
+        Returns:
+            (int): The number of nodes counted.
+        """
+        return len(self.membership)
+
+    def cardinality(self, collection):
+        """
+        Return the number of nodes that can match a variable.
+
+        Args:
+            collection (str|None): The collection the variable is restricted
+            to, or None for any node.
+
+        Returns:
+            (int): The number of candidate nodes.
+        """
+        if collection is None:
+            return self.num_nodes
+        return self.collection_sizes.get(collection, 0)
+
+    def fanout(self, label, forward):
+        """
+        Return the average number of neighbors reached by following an edge
+        from a node that has at least one such edge.
+
+        Args:
+            label (any|None): The label of the edge, None for any label.
+            forward (bool): True to follow the edge in its own direction,
+            False to follow it backwards.
+
+        Returns:
+            (float): The estimated number of neighbors per node.
+        """
+        if label is None:
+            edges = sum(self.edge_counts.values())
+            ends = self.num_nodes
+        else:
+            edges = self.edge_counts.get(label, 0)
+            counts = self.source_counts if forward else self.target_counts
+            ends = counts.get(label, 0)
+        return edges / ends if ends else 0.0
+
+    def neighbors(self, node, label, forward):
+        """
+        Yield the nodes reached from node by an edge with label.
+
+        Args:
+            node (Node): The node to expand.
+            label (any|None): The label of the edge, None for any label.
+            forward (bool): True to follow outgoing edges, False to follow
+            incoming edges.
+
+        Yields:
+            (Node): Each neighboring node.
+        """
+        if forward:
+            edges = node.relations.items()
+        else:
+            edges = self.incoming.get(node, {}).items()
+        for other, l in edges:
+            if label is None or l == label:
+                yield other
+
+
+class Plan:
+    """
+    A Plan is the order in which the edges of a Pattern are expanded,
+    starting from the variable with the smallest estimated cardinality.
+    """
+
+    def __init__(self, pattern, stats, bindings):
+        """
+        Choose a start variable and expansion order for pattern.
+
+        Args:
+            pattern (Pattern): The pattern to plan.
+            stats (Statistics): The statistics used to estimate costs.
+            bindings (dict): Variables already bound to a Node.
+
+        Returns:
+            (Plan): The initialized Plan object.
+        """
+        self.pattern = pattern
+        variables = pattern.variables
+
+        # estimate how many nodes can match each position on its own
+        def estimate(i):
+            name, collection = variables[i]
+            if name in bindings:
+                return 1
+            return stats.cardinality(collection)
+
+        # fraction of all nodes that can match each position
+        def selectivity(i):
+            if not stats.num_nodes:
+                return 0.0
+            return min(estimate(i) / stats.num_nodes, 1.0)
+
+        # start at the most selective position
+        self.start = min(range(len(variables)), key=estimate)
+        self.estimates = [estimate(self.start)]
+
+        # greedily grow the matched segment [lo, hi] by the cheaper side;
+        # each step is (edge index, forward, from position, to position)
+        self.steps = []
+        lo = hi = self.start
+        rows = self.estimates[0]
+        while lo > 0 or hi < len(variables) - 1:
+            options = []
+            if lo > 0:
+                label, forward = pattern.edges[lo - 1]
+                cost = stats.fanout(label, not forward) * selectivity(lo - 1)
+                options.append((cost, lo - 1, not forward, lo, lo - 1))
+            if hi < len(variables) - 1:
+                label, forward = pattern.edges[hi]
+                cost = stats.fanout(label, forward) * selectivity(hi + 1)
+                options.append((cost, hi, forward, hi, hi + 1))
+            cost, edge, forward, source, target = min(options)
+            self.steps.append((edge, forward, source, target))
+            rows *= cost
+            self.estimates.append(rows)
+            lo, hi = min(lo, target), max(hi, target)
+
+    def __str__(self):
+        """
+        Return the str representation of this Plan.
+
+        Returns:
+            (str): One line per operator with its estimated row count.
+        """
+        variables = self.pattern.variables
+        lines = [
+            "start {} (~{:.0f} rows)".format(
+                variables[self.start][0], self.estimates[0]
+            )
+        ]
+        for (edge, forward, source, target), rows in zip(
+            self.steps, self.estimates[1:]
+        ):
+            label = self.pattern.edges[edge][0]
+            lines.append(
+                "expand {} {} [:{}] {} (~{:.0f} rows)".format(
+                    variables[source][0],
+                    "->" if forward else "<-",
+                    label if label is not None else "",
+                    variables[target][0],
+                    rows,
+                )
+            )
+        return "\n".join(lines)
+
+
+class Query:
+    """
+    A Query matches a Pattern against a Database by running a Plan as a
+    pipeline of generators, one per expansion step.
+    """
+
+    def __init__(self, db, pattern, bindings):
+        """
+        Initialize a Query.
+
+        Args:
+            db (Database): The Database to match against.
+            pattern (str): The pattern to match.
+            bindings (dict): Variable names mapped to the Node they must
+            match.
+
+        Returns:
+            (Query): The initialized Query object.
+
+        Raises:
+            Exception: If a binding is not a variable in pattern.
+            Exception: If a binding is not of type Node.
+        """
+        self.pattern = Pattern(pattern)
+        names = {name for name, _ in self.pattern.variables}
+        for name, node in bindings.items():
+            if name not in names:
+                raise Exception(f"{name} is not a variable in the pattern")
+            if not isinstance(node, Node):
+                raise Exception(f"binding {name} must be a node object")
+        self.db = db
+        self.bindings = bindings
+        self.stats = db.statistics
+        self.plan = Plan(self.pattern, self.stats, bindings)
+
+    def __iter__(self):
+        """
+        Iterate over the matches of this Query.
+
+        Yields:
+            (dict): Each match as a dict of variable name to Node, leaving out
+            anonymous variables.
+        """
+        return self._matches(row for _, row in self._scan())
+
+    def page(self, limit=100, after=None):
+        """
+        Return a page of the matches of this Query. Matches are found in the
+        order of the nodes the plan starts from, so a page costs about as
+        much as finding limit matches plus the matches of one start node
+        already returned.
+
+        Args:
+            limit (int): The maximum number of matches to return.
+            after (tuple|None): The cursor returned with the previous page,
+            or None for the first page.
+
+        Returns:
+            (tuple): The list of matches and the cursor of the next page,
+            which is None when there are no more matches.
+
+        Raises:
+            Exception: If limit is not a positive int.
+        """
+
+        # limit must be a positive int
+        if not isinstance(limit, int) or limit < 1:
+            raise Exception("limit must be a positive int")
+
+        # the cursor is the position of a start node and the number of its
+        # matches already returned
+        start, skip = None, 0
+        if after is not None:
+            start, skip = tuple(after[:2]), after[2]
+
+        result = []
+        for position, row in self._scan(start):
+            for found, match in enumerate(self._matches([row])):
+                if position == start and found < skip:
+                    continue
+                if len(result) == limit:
+                    return result, position + (found,)
+                result.append(match)
+        return result, None
+
+    def _matches(self, rows):
+        """
+        Expand start rows across every edge of the plan.
+
+        Yields:
+            (dict): Each match as a dict of variable name to Node, leaving out
+            anonymous variables.
+        """
+        for step in self.plan.steps:
+            rows = self._expand(rows, *step)
+        names = [n for n, _ in self.pattern.variables if not n.startswith("_")]
+        for row in rows:
+            yield {name: row[name] for name in names}
+
+    def _accepts(self, row, position, node):
+        """
+        Return whether node can be assigned to the variable at position.
+
+        Returns:
+            (bool): True if node satisfies the label, binding and any earlier
+            assignment of the variable.
+        """
+        name, collection = self.pattern.variables[position]
+        if collection is not None:
+            if self.stats.membership.get(node, None) != collection:
+                return False
+        if name in self.bindings and self.bindings[name] is not node:
+            return False
+        if name in row and row[name] is not node:
+            return False
+        return True
+
+    def _scan(self, start=None):
+        """
+        Yield a row for each candidate of the start variable, in the order
+        the candidates were inserted.
+
+        Args:
+            start (tuple|None): If specified, the position of the candidate
+            to start at.
+
+        Yields:
+            (tuple): The position of the candidate, a tuple of its collection
+            name and sequence number, and a row binding only the start
+            variable.
+        """
+        name, collection = self.pattern.variables[self.plan.start]
+        if name in self.bindings:
+            sources = []
+            if self._accepts({}, self.plan.start, self.bindings[name]):
+                yield (None, None), {name: self.bindings[name]}
+        elif collection is not None:
+            if collection not in self.db.collections:
+                return
+            sources = [(collection, self.db.collections[collection].nodes)]
+        else:
+            sources = [(None, self.db.nodes)] + [
+                (c, self.db.collections[c].nodes) for c in self.db.collections
+            ]
+
+        # skip the sources before the start position
+        if start is not None:
+            names = [c for c, _ in sources]
+            if start[0] in names:
+                sources = sources[names.index(start[0]):]
+        for c, nodes in sources:
+            after = None
+            if start is not None and c == start[0]:
+                after = start[1] - 1
+            for seq, key in nodes.iter_from(after):
+                node = nodes[key]
+                if self._accepts({}, self.plan.start, node):
+                    yield (c, seq), {name: node}
+
+    def _expand(self, rows, edge, forward, source, target):
+        """
+        Extend each row across one edge of the pattern.
+
+        Yields:
+            (dict): Each extended row.
+        """
+        label = self.pattern.edges[edge][0]
+        source_name = self.pattern.variables[source][0]
+        target_name = self.pattern.variables[target][0]
+        for row in rows:
+            node = row[source_name]
+            for other in self.stats.neighbors(node, label, forward):
+                if self._accepts(row, target, other):
+                    extended = dict(row)
+                    extended[target_name] = other
+                    yield extended
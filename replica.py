@@ -0,0 +1,105 @@
+import os
+from pickle import load
+from pathlib import Path
+from time import time, sleep
+from database import Database
+from change_log import ChangeLog
+
+
+class Replica(Database):
+    """
+    A Replica is a read-only Database kept up to date by applying the change
+    log of a primary Database opened with publish=True, usually from
+    another process. The Replica keeps its own copy on disk along with its
+    position in the log, so it catches up from where it stopped after a
+    restart.
+    """
+
+    def __init__(self, primary_name, file_name, cache_bytes=None):
+        """
+        Initialize a Replica.
+
+        Args:
+            primary_name (str): The directory of the primary Database.
+            file_name (str): The directory the Replica is stored in.
+            cache_bytes (int|None): See Database.
+
+        Returns:
+            (Replica): The initialized Replica object.
+        """
+        super().__init__(file_name, cache_bytes)
+        self.log_path = Path(primary_name).joinpath("changes.log")
+        self.position_path = self.file.db_path.joinpath("replica.p")
+        self.file.read_only = True
+
+        # byte offset, sequence number and timestamp of the last record
+        # applied
+        self.offset = 0
+        self.seq = 0
+        self.applied_at = None
+        if self.position_path.exists():
+            with self.position_path.open(mode="rb") as f:
+                self.offset, self.seq, self.applied_at = load(f)
+
+    def poll(self, limit=None):
+        """
+        Apply the records added to the change log since the last poll and
+        save the result.
+
+        Args:
+            limit (int|None): If specified, the maximum number of records to
+            apply.
+
+        Returns:
+            (int): The number of records applied.
+        """
+        applied = 0
+        with self.file.write_lock, self.file.batch():
+            for offset, record in ChangeLog.read(self.log_path, self.offset):
+                seq, timestamp, op, fields = record
+                self.file.apply(op, fields)
+                self.offset, self.seq, self.applied_at = offset, seq, timestamp
+                applied += 1
+                if limit is not None and applied >= limit:
+                    break
+            if applied:
+                self.file.version += 1
+                self.file.dirty = True
+
+        # records are applied idempotently, so saving the position after the
+        # data is enough to resume after a crash
+        if applied:
+            position = (self.offset, self.seq, self.applied_at)
+            temporary = self.file.write(self.position_path, position)
+            os.replace(temporary, self.position_path)
+        return applied
+
+    def follow(self, interval=0.1, until=None):
+        """
+        Poll the change log until until returns True.
+
+        Args:
+            interval (float): The number of seconds to wait between polls
+            that found nothing to apply.
+            until (callable|None): Called after each poll, following stops
+            when it returns True. If None, follow forever.
+        """
+        while until is None or not until():
+            if not self.poll():
+                sleep(interval)
+
+    def lag(self):
+        """
+        Return how far this Replica is behind its primary.
+
+        Returns:
+            (dict): The number of records not yet applied and the age in
+            seconds of the oldest of them, 0 when caught up.
+        """
+        records = 0
+        seconds = 0.0
+        for _, record in ChangeLog.read(self.log_path, self.offset):
+            if not records:
+                seconds = time() - record[1]
+            records += 1
+        return {"records": records, "seconds": seconds}
@@ -0,0 +1,595 @@
+import asyncio
+import json
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit, parse_qsl, unquote
+from database import Database
+
+
+class HTTPError(Exception):
+    """
+    HTTPError is raised by request handlers to send an error response.
+    """
+
+    def __init__(self, status, message):
+        """
+        Initialize a HTTPError.
+
+        Args:
+            status (int): The HTTP status code of the response.
+            message (str): The error message sent to the client.
+        """
+        super().__init__(message)
+        self.status = status
+
+
+class QueryValue(str):
+    """
+    QueryValue is a str taken from the query string, where every value is a
+    str, unlike values from a JSON body which keep their type.
+    """
+
+
+# write endpoints, applied in batches by the write loop
+WRITES = ("collections", "nodes", "relations")
+
+# read endpoints and the Server method that handles each of them
+READS = {
+    "get": "_get",
+    "find": "_find",
+    "related_by": "_related_by",
+    "neighbors": "_neighbors",
+    "scan": "_scan",
+    "related_difference": "_related_difference",
+    "match": "_match",
+}
+
+REASONS = {
+    200: "OK",
+    201: "Created",
+    400: "Bad Request",
+    404: "Not Found",
+    405: "Method Not Allowed",
+    500: "Internal Server Error",
+}
+
+
+class Server:
+    """
+    Server exposes a single Database over HTTP with asyncio. Connections are
+    kept alive between requests, concurrent writes are applied together and
+    saved to disk once, and every Database access runs on one worker thread
+    so traversals never block the event loop or race with writes.
+    """
+
+    def __init__(self, db, host="127.0.0.1", port=8080, max_batch=256):
+        """
+        Initialize a Server.
+
+        Args:
+            db (Database): The Database to serve.
+            host (str): The interface to listen on.
+            port (int): The port to listen on.
+            max_batch (int): The maximum number of writes saved together.
+
+        Returns:
+            (Server): The initialized Server object.
+        """
+        self.db = db
+        self.host = host
+        self.port = port
+        self.max_batch = max_batch
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.writes = None
+        self.server = None
+        self.writer_task = None
+        # the task serving each open connection, and the connections
+        # waiting for their next request, which stop closes right away
+        self.connections = {}
+        self.idle = set()
+        self.stopping = False
+        # (collection name or None, key) of each node, for responses
+        self.keys = {}
+        for key, node in db.nodes.items():
+            self.keys[node] = (None, key)
+        for name, collection in db.collections.items():
+            for key, node in collection.nodes.items():
+                self.keys[node] = (name, key)
+
+    async def start(self):
+        """
+        Start listening for connections and applying writes.
+        """
+        self.writes = asyncio.Queue()
+        self.writer_task = asyncio.ensure_future(self._write_loop())
+        self.server = await asyncio.start_server(
+            self._handle_connection, self.host, self.port
+        )
+        # use the port chosen by the os when port is 0
+        self.port = self.server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        """
+        Stop accepting connections, close idle connections once their
+        current request is answered and finish pending writes.
+        """
+        self.server.close()
+        self.stopping = True
+        for writer in list(self.idle):
+            writer.close()
+        await asyncio.gather(*self.connections.values())
+        await self.server.wait_closed()
+        await self.writes.join()
+        self.writer_task.cancel()
+        self.executor.shutdown()
+
+    async def serve_forever(self):
+        """
+        Start the server and run until cancelled.
+        """
+        await self.start()
+        print(f"Serving on http://{self.host}:{self.port}")
+        try:
+            await self.server.serve_forever()
+        finally:
+            await self.stop()
+
+    async def _handle_connection(self, reader, writer):
+        """
+        Serve requests from one client connection until it is closed.
+        """
+        self.connections[writer] = asyncio.current_task()
+        try:
+            while not self.stopping:
+                self.idle.add(writer)
+                try:
+                    head = await reader.readuntil(b"\r\n\r\n")
+                except (
+                    asyncio.IncompleteReadError,
+                    asyncio.LimitOverrunError,
+                    ConnectionError,
+                ):
+                    break
+                finally:
+                    self.idle.discard(writer)
+                lines = head.decode("latin-1").split("\r\n")
+                try:
+                    method, target, version = lines[0].split(" ", 2)
+                except ValueError:
+                    break
+                headers = {}
+                for line in lines[1:]:
+                    if ":" in line:
+                        name, value = line.split(":", 1)
+                        headers[name.strip().lower()] = value.strip()
+                try:
+                    length = int(headers.get("content-length", 0))
+                except ValueError:
+                    # the body cannot be skipped, so the connection is closed
+                    await self._respond(
+                        writer, 400, {"error": "invalid content-length"}, False
+                    )
+                    break
+                body = await reader.readexactly(length) if length else b""
+
+                status, payload = await self._dispatch(method, target, body)
+
+                # keep the connection open unless the client asks otherwise
+                connection = headers.get("connection", "").lower()
+                keep_alive = (
+                    not self.stopping
+                    and connection != "close"
+                    and (version == "HTTP/1.1" or connection == "keep-alive")
+                )
+                await self._respond(writer, status, payload, keep_alive)
+                if not keep_alive:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            del self.connections[writer]
+            writer.close()
+
+    async def _respond(self, writer, status, payload, keep_alive):
+        """
+        Send a JSON response.
+
+        Args:
+            writer (StreamWriter): The connection to respond on.
+            status (int): The HTTP status code.
+            payload (any): The JSON serializable response body.
+            keep_alive (bool): Whether the connection stays open.
+        """
+        data = json.dumps(payload).encode()
+        writer.write(
+            (
+                f"HTTP/1.1 {status} {REASONS.get(status, '')}\r\n"
+                "Content-Type: application/json\r\n"
+                f"Content-Length: {len(data)}\r\n"
+                "Connection: {}\r\n\r\n".format(
+                    "keep-alive" if keep_alive else "close"
+                )
+            ).encode()
+            + data
+        )
+        await writer.drain()
+
+    async def _dispatch(self, method, target, body):
+        """
+        Route a request to its handler. Writes are POSTed to /collections,
+        /nodes and /relations, nodes are fetched from /nodes/<key> and reads
+        take their arguments from the query string or a JSON body. Invalid
+        requests and the errors the Database raises for invalid arguments
+        are answered with 400, anything else with 500.
+
+        Returns:
+            (tuple): The status code and JSON serializable response body.
+        """
+        url = urlsplit(target)
+        path = [p for p in url.path.split("/") if p]
+        try:
+            args = {k: QueryValue(v) for k, v in parse_qsl(url.query)}
+            if body:
+                body = json.loads(body)
+                if not isinstance(body, dict):
+                    raise HTTPError(400, "body must be a JSON object")
+                args.update(body)
+            if len(path) == 1 and path[0] in WRITES:
+                if method != "POST":
+                    raise HTTPError(405, f"{method} not allowed on {url.path}")
+                return 201, await self._write(path[0], args)
+            if len(path) == 2 and path[0] == "nodes":
+                args["key"] = unquote(path[1])
+                path = ["get"]
+            if len(path) == 1 and path[0] in READS:
+                if method not in ("GET", "POST"):
+                    raise HTTPError(405, f"{method} not allowed on {url.path}")
+                handler = getattr(self, READS[path[0]])
+                return 200, await self._read(handler, args)
+            raise HTTPError(404, f"{url.path} not found")
+        except HTTPError as e:
+            return e.status, {"error": str(e)}
+        except json.JSONDecodeError as e:
+            return 400, {"error": f"invalid json: {e}"}
+        except Exception as e:
+            # the database raises plain Exceptions for invalid arguments
+            if type(e) is Exception:
+                return 400, {"error": str(e)}
+            return 500, {"error": f"{type(e).__name__}: {e}"}
+
+    async def _read(self, handler, *args):
+        """
+        Run a read handler on the database thread.
+
+        Returns:
+            (any): The result of the handler.
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, handler, *args)
+
+    async def _write(self, kind, params):
+        """
+        Queue a write and wait until it is applied and saved.
+
+        Returns:
+            (any): The result of the write.
+        """
+        future = asyncio.get_running_loop().create_future()
+        await self.writes.put((kind, params, future))
+        return await future
+
+    async def _write_loop(self):
+        """
+        Apply queued writes in batches, saving to disk once per batch.
+        """
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.writes.get()]
+            while len(batch) < self.max_batch and not self.writes.empty():
+                batch.append(self.writes.get_nowait())
+            try:
+                results = await loop.run_in_executor(
+                    self.executor, self._apply, batch
+                )
+                for (_, _, future), (error, result) in zip(batch, results):
+                    if future.done():
+                        continue
+                    if error is None:
+                        future.set_result(result)
+                    else:
+                        future.set_exception(error)
+            except Exception as e:
+                for _, _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+            finally:
+                for _ in batch:
+                    self.writes.task_done()
+
+    def _apply(self, batch):
+        """
+        Apply a batch of writes on the database thread.
+
+        Returns:
+            (list): A tuple of (exception or None, result) for each write.
+        """
+        handlers = {
+            "collections": self._add_collection,
+            "nodes": self._insert,
+            "relations": self._relate,
+        }
+        results = []
+        with self.db.file.batch():
+            for kind, params, _ in batch:
+                try:
+                    results.append((None, handlers[kind](params)))
+                except Exception as e:
+                    results.append((e, None))
+        return results
+
+    def _lookup(self, ref):
+        """
+        Return the Node stored under ref["key"] in the collection
+        ref["collection"], or among the top level nodes.
+
+        Args:
+            ref (dict): The key and collection of the Node.
+
+        Returns:
+            (Node): The Node.
+
+        Raises:
+            HTTPError: If ref is not a JSON object or the key or collection
+            is not a str, number or null.
+            HTTPError: If the collection or node does not exist.
+        """
+        key = self._hashable(ref, "key")
+        collection = self._hashable(ref, "collection")
+        if collection is None:
+            nodes = self.db.nodes
+        elif collection in self.db.collections:
+            nodes = self.db.collections[collection].nodes
+        else:
+            raise HTTPError(404, f"collection {collection} not found")
+        if key not in nodes:
+            raise HTTPError(404, f"node {key} not found")
+        return nodes[key]
+
+    def _object(self, query, name):
+        """
+        Return the argument name as a JSON object.
+
+        Args:
+            query (dict): The arguments of the request.
+            name (str): The name of the argument.
+
+        Returns:
+            (dict): The argument, or an empty dict if it is missing.
+
+        Raises:
+            HTTPError: If the argument is not a JSON object.
+        """
+        value = query.get(name, {})
+        if not isinstance(value, dict):
+            raise HTTPError(400, f"{name} must be a JSON object")
+        return value
+
+    def _hashable(self, query, name):
+        """
+        Return the argument name, which is used as a dict key.
+
+        Args:
+            query (dict): The arguments of the request.
+            name (str): The name of the argument.
+
+        Returns:
+            (any): The argument, or None if it is missing.
+
+        Raises:
+            HTTPError: If the argument is a JSON array or object.
+        """
+        value = query.get(name)
+        if isinstance(value, (list, dict)):
+            raise HTTPError(400, f"{name} must be a str, number or null")
+        return value
+
+    def _int(self, query, name, default=None):
+        """
+        Return the argument name as an int.
+
+        Args:
+            query (dict): The arguments of the request.
+            name (str): The name of the argument.
+            default (int|None): The value if the argument is missing.
+
+        Returns:
+            (int|None): The argument as an int.
+
+        Raises:
+            HTTPError: If the argument is not an int.
+        """
+        value = query.get(name, default)
+        if value is None:
+            return None
+        try:
+            return int(value)
+        except (TypeError, ValueError):
+            raise HTTPError(400, f"{name} must be an int")
+
+    def _serialize(self, node):
+        """
+        Return the JSON serializable representation of a Node.
+
+        Returns:
+            (dict): The key, collection and data of node.
+        """
+        collection, key = self.keys.get(node, (None, node.id))
+        return {"key": key, "collection": collection, "data": node.data}
+
+    def _add_collection(self, params):
+        """
+        Add a collection named params["name"].
+        """
+        self.db.add(params.get("name"))
+        return {"name": params.get("name")}
+
+    def _insert(self, params):
+        """
+        Insert params["data"] as a node, optionally under a key and
+        collection.
+        """
+        collection = self._hashable(params, "collection")
+        key = self._hashable(params, "key")
+        if collection is None:
+            target = self.db
+            nodes = self.db.nodes
+        elif collection in self.db.collections:
+            target = self.db.collections[collection]
+            nodes = target.nodes
+        else:
+            raise HTTPError(404, f"collection {collection} not found")
+        node = target.insert(params.get("data"), key=key)
+        if key is None:
+            key = node.id
+        self.keys[node] = (collection, key)
+        return self._serialize(nodes[key])
+
+    def _relate(self, params):
+        """
+        Relate the node params["from"] to the node params["to"].
+        """
+        f_node = self._lookup(self._object(params, "from"))
+        t_node = self._lookup(self._object(params, "to"))
+        f_node.relate_to(
+            t_node,
+            by=params.get("by"),
+            bidirectional=params.get("bidirectional", False),
+        )
+        return {"from": self._serialize(f_node), "to": self._serialize(t_node)}
+
+    def _get(self, query):
+        """
+        Return a node and its relations.
+        """
+        node = self._lookup(query)
+        result = self._serialize(node)
+        result["relations"] = [
+            {"node": self._serialize(n), "by": label}
+            for n, label in node.relations.items()
+        ]
+        return result
+
+    def _find(self, query):
+        """
+        Return nodes whose data matches every remaining query argument.
+        Arguments from the query string are compared as str.
+        """
+        collection = self._hashable(query, "collection")
+        query.pop("collection", None)
+        limit = self._int(query, "limit", 100)
+        query.pop("limit", None)
+        if collection is None:
+            nodes = self.db.nodes
+        elif collection in self.db.collections:
+            nodes = self.db.collections[collection].nodes
+        else:
+            raise HTTPError(404, f"collection {collection} not found")
+        result = []
+        for node in nodes.values():
+            data = node.data
+            if all(
+                str(data.get(k)) == v
+                if isinstance(v, QueryValue)
+                else data.get(k) == v
+                for k, v in query.items()
+            ):
+                result.append(self._serialize(node))
+                if len(result) >= limit:
+                    break
+        return result
+
+    def _related_by(self, query):
+        """
+        Return the nodes related to a node by a label.
+        """
+        node = self._lookup(query)
+        related = node.related_by(query.get("label"))
+        return [self._serialize(n) for n in related]
+
+    def _neighbors(self, query):
+        """
+        Return a page of the nodes related to a node by a label.
+        """
+        node = self._lookup(query)
+        nodes, cursor = node.neighbors(
+            self._hashable(query, "label"),
+            limit=self._int(query, "limit", 100),
+            after=self._int(query, "after"),
+        )
+        return {"nodes": [self._serialize(n) for n in nodes], "after": cursor}
+
+    def _scan(self, query):
+        """
+        Return a page of the nodes in a collection, or of the top level
+        nodes.
+        """
+        collection = self._hashable(query, "collection")
+        if collection is None:
+            target = self.db
+        elif collection in self.db.collections:
+            target = self.db.collections[collection]
+        else:
+            raise HTTPError(404, f"collection {collection} not found")
+        nodes, cursor = target.scan(
+            limit=self._int(query, "limit", 100),
+            after=self._int(query, "after"),
+        )
+        return {
+            "nodes": [self._serialize(n) for n in nodes.values()],
+            "after": cursor,
+        }
+
+    def _related_difference(self, query):
+        """
+        Return indirect relations of a node, most frequent first.
+        """
+        node = self._lookup(query)
+        result = node.related_difference(
+            query.get("label_1"), query.get("label_2")
+        )
+        return [
+            {"node": self._serialize(n), "count": count}
+            for n, count in sorted(result.items(), key=lambda i: -i[1])
+        ]
+
+    def _match(self, params):
+        """
+        Return the matches of a pattern, with variables bound to keys.
+        """
+        bindings = self._object(params, "bindings")
+        bindings = {
+            name: self._lookup(self._object(bindings, name))
+            for name in bindings
+        }
+        limit = self._int(params, "limit", 100)
+        result = []
+        for row in self.db.match(params.get("pattern"), **bindings):
+            result.append({k: self._serialize(v) for k, v in row.items()})
+            if len(result) >= limit:
+                break
+        return result
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Serve a GrapevineDB.")
+    parser.add_argument("--data", default="data")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    args = parser.parse_args()
+
+    try:
+        server = Server(Database(args.data), args.host, args.port)
+        asyncio.run(server.serve_forever())
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,543 @@
+from math import log
+from threading import Thread
+from time import monotonic
+
+MASK_64 = (1 << 64) - 1
+
+
+def high_bits(m):
+    """
+    Return m one byte registers packed into an int with only the high bit
+    of each register set.
+
+    Args:
+        m (int): The number of registers.
+
+    Returns:
+        (int): The packed registers.
+    """
+    return int.from_bytes(b"\x80" * m, "little")
+
+
+def register_max(a, b, high):
+    """
+    Return the larger of each pair of registers of a and b, with all the
+    registers packed into an int one byte each, so every register is
+    compared at once by a few int operations.
+
+    Args:
+        a (int): The first packed registers.
+        b (int): The second packed registers.
+        high (int): high_bits for the number of registers.
+
+    Returns:
+        (int): The packed registers.
+    """
+    # registers are below 128, so setting the high bit of each register of
+    # a and subtracting b never borrows across registers and leaves the high
+    # bit set exactly where a >= b
+    mask = ((((a | high) - b) & high) >> 7) * 0xFF
+    return (a & mask) | (b & ~mask)
+
+
+def cardinality(registers):
+    """
+    Return the HyperLogLog estimate of the number of distinct items counted
+    by registers.
+
+    Args:
+        registers (bytes): The registers, one byte each.
+
+    Returns:
+        (float): The estimate.
+    """
+    m = len(registers)
+    alpha = {16: 0.673, 32: 0.697, 64: 0.709}.get(
+        m, 0.7213 / (1 + 1.079 / m)
+    )
+    # registers only hold a few distinct ranks, so sum by rank, counting
+    # each rank with one pass over the bytes
+    ranks = [registers.count(r) for r in range(max(registers) + 1)]
+    estimate = alpha * m * m / sum(
+        count * 2.0 ** -r for r, count in enumerate(ranks) if count
+    )
+
+    # use linear counting while many registers are still empty
+    zeros = ranks[0]
+    if estimate <= 2.5 * m and zeros:
+        return m * log(m / zeros)
+    return estimate
+
+
+class HyperLogLog:
+    """
+    A HyperLogLog estimates the number of distinct items added to it using
+    2 ** precision one byte registers. The relative standard error is about
+    1.04 / sqrt(2 ** precision).
+    """
+
+    def __init__(self, precision=10, registers=None):
+        """
+        Initialize a HyperLogLog.
+
+        Args:
+            precision (int): The number of bits used to pick a register,
+            between 4 and 16.
+            registers (bytearray|None): If specified, the registers to start
+            from.
+
+        Returns:
+            (HyperLogLog): The initialized HyperLogLog object.
+
+        Raises:
+            Exception: If precision is not between 4 and 16.
+        """
+
+        # precision must be in the range the estimator is tuned for
+        if not isinstance(precision, int) or not 4 <= precision <= 16:
+            raise Exception("precision must be an int between 4 and 16")
+
+        self.precision = precision
+        self.m = 1 << precision
+        if registers is None:
+            registers = bytearray(self.m)
+        self.registers = registers
+
+    def __len__(self):
+        """
+        Return the estimated number of distinct items.
+
+        Returns:
+            (int): The rounded estimate.
+        """
+        return int(round(self.estimate()))
+
+    def copy(self):
+        """
+        Return a copy of this HyperLogLog.
+
+        Returns:
+            (HyperLogLog): The copy.
+        """
+        return HyperLogLog(self.precision, bytearray(self.registers))
+
+    def position(self, item):
+        """
+        Return the register an item updates and the rank it stores there.
+
+        Args:
+            item (any): A hashable item.
+
+        Returns:
+            (tuple): The index of the register and the rank.
+        """
+        # hash a tuple so small ints are spread over all registers too
+        h = hash((item,)) & MASK_64
+        index = h >> (64 - self.precision)
+        rest = h & ((1 << (64 - self.precision)) - 1)
+        return index, 64 - self.precision - rest.bit_length() + 1
+
+    def add(self, item):
+        """
+        Add an item.
+
+        Args:
+            item (any): A hashable item.
+        """
+        index, rank = self.position(item)
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def merge(self, other):
+        """
+        Add every item counted by other to this HyperLogLog.
+
+        Args:
+            other (HyperLogLog): A HyperLogLog with the same precision.
+        """
+        merged = register_max(
+            int.from_bytes(self.registers, "little"),
+            int.from_bytes(other.registers, "little"),
+            high_bits(self.m),
+        )
+        self.registers = bytearray(merged.to_bytes(self.m, "little"))
+
+    def estimate(self):
+        """
+        Return the estimated number of distinct items.
+
+        Returns:
+            (float): The estimate.
+        """
+        return cardinality(self.registers)
+
+
+class CountMinSketch:
+    """
+    A CountMinSketch estimates how many times each key was counted in
+    width * depth counters. Estimates never undercount, and overcount by
+    more than e / width of the total with probability at most e ** -depth.
+    """
+
+    def __init__(self, width=2048, depth=4):
+        """
+        Initialize a CountMinSketch.
+
+        Args:
+            width (int): The number of counters in each row.
+            depth (int): The number of rows.
+
+        Returns:
+            (CountMinSketch): The initialized CountMinSketch object.
+
+        Raises:
+            Exception: If width or depth is not a positive int.
+        """
+
+        # width and depth must be positive ints
+        for value in (width, depth):
+            if not isinstance(value, int) or value < 1:
+                raise Exception("width and depth must be positive ints")
+
+        self.width = width
+        self.depth = depth
+        self.rows = [[0] * width for _ in range(depth)]
+        self.total = 0
+
+    def add(self, key, count=1):
+        """
+        Count key. Counts may be taken back with a negative count, as long
+        as no key's count goes below 0.
+
+        Args:
+            key (any): A hashable key.
+            count (int): The amount to count key by.
+        """
+        self.total += count
+        for i, row in enumerate(self.rows):
+            row[hash((i, key)) % self.width] += count
+
+    def estimate(self, key):
+        """
+        Return the estimated count of key.
+
+        Args:
+            key (any): A hashable key.
+
+        Returns:
+            (int): The estimated count, never lower than the real count.
+        """
+        return min(
+            row[hash((i, key)) % self.width] for i, row in enumerate(self.rows)
+        )
+
+
+class GraphSketch:
+    """
+    GraphSketch holds sketches of a Database that answer neighborhood size,
+    label cardinality and degree questions approximately in constant time.
+    Label and degree counts are updated as relations are created and
+    removed. Neighborhood sizes, and distinct targets after relations are
+    removed, cannot be updated in place, so once they are max_age seconds
+    old and the Database changed they are rebuilt from a Snapshot on a
+    background thread, and answers come from the previous build until it
+    finishes.
+    """
+
+    def __init__(
+        self, db, hops=3, precision=10, width=2048, depth=4, max_age=60.0
+    ):
+        """
+        Build sketches of every Node in db. Neighborhood sizes are found by
+        merging the HyperLogLogs of neighbors once per hop, so building
+        costs O(hops * relations * 2 ** precision / 64) int operations.
+
+        Args:
+            db (Database): The Database to sketch.
+            hops (int): The largest number of hops neighborhoods are
+            estimated for.
+            precision (int): The precision of each HyperLogLog.
+            width (int): The width of the CountMinSketch.
+            depth (int): The depth of the CountMinSketch.
+            max_age (float): The number of seconds after which changed
+            sketches are rebuilt.
+
+        Returns:
+            (GraphSketch): The initialized GraphSketch object.
+        """
+        self.db = db
+        self.hops = hops
+        self.precision = precision
+        self.width = width
+        self.depth = depth
+        self.max_age = max_age
+        # when the sketches were last built, whether the Database changed
+        # since, the thread rebuilding them and the relations created and
+        # removed while it runs
+        self.built = monotonic()
+        self.changed = False
+        self.thread = None
+        self.pending = None
+        self._adopt(self._build())
+
+    def _build(self, snapshot=None):
+        """
+        Build the sketches from the Nodes in the Database or a Snapshot.
+
+        Args:
+            snapshot (Snapshot|None): If specified, the Snapshot to read.
+
+        Returns:
+            (tuple): The label counts, out and in degrees, distinct targets
+            and neighborhood sizes.
+        """
+        view = getattr if snapshot is None else snapshot.view
+        file = self.db.file
+        nodes = list(view(file, "nodes").values())
+        for collection in view(file, "collections").values():
+            nodes.extend(view(collection, "nodes").values())
+
+        # relations per label, and degrees keyed by id or (id, label)
+        labels = CountMinSketch(self.width, self.depth)
+        out_degrees = CountMinSketch(self.width, self.depth)
+        in_degrees = CountMinSketch(self.width, self.depth)
+        # distinct targets of each label
+        targets = {}
+        # registers of each node packed into an int, see register_max
+        hll = HyperLogLog(self.precision)
+        registers = {}
+        for node in nodes:
+            index, rank = hll.position(node.id)
+            registers[node] = rank << (8 * index)
+        for node in nodes:
+            for relation, label in view(node, "relations").items():
+                labels.add(label)
+                out_degrees.add(node.id)
+                out_degrees.add((node.id, label))
+                in_degrees.add(relation.id)
+                in_degrees.add((relation.id, label))
+                if label not in targets:
+                    targets[label] = HyperLogLog(self.precision)
+                targets[label].add(relation.id)
+                # relations may point at nodes no longer in the database
+                if relation not in registers:
+                    index, rank = hll.position(relation.id)
+                    registers[relation] = rank << (8 * index)
+
+        neighbors = {
+            node: [r for r in view(node, "relations") if r in registers]
+            for node in registers
+        }
+        high = high_bits(hll.m)
+        # estimated neighborhood size of each node, by number of hops
+        reach = {node: [] for node in registers}
+        for _ in range(self.hops):
+            merged = {}
+            for node, value in registers.items():
+                previous = value
+                for relation in neighbors[node]:
+                    value = register_max(value, registers[relation], high)
+                merged[node] = value
+                # the node itself is in its own sketch
+                if value == previous and reach[node]:
+                    reach[node].append(reach[node][-1])
+                else:
+                    estimate = cardinality(value.to_bytes(hll.m, "little"))
+                    reach[node].append(max(estimate - 1, 0.0))
+            registers = merged
+        return labels, out_degrees, in_degrees, targets, reach
+
+    def _adopt(self, sketches):
+        """
+        Replace the sketches with ones returned by _build.
+        """
+        (
+            self.labels,
+            self.out_degrees,
+            self.in_degrees,
+            self.targets,
+            self.reach,
+        ) = sketches
+
+    def _count(self, source, target, label, count):
+        """
+        Count a relation that was created, or uncount one that was removed
+        when count is -1. Removed relations stay in distinct targets until
+        the next rebuild.
+        """
+        self.labels.add(label, count)
+        self.out_degrees.add(source.id, count)
+        self.out_degrees.add((source.id, label), count)
+        self.in_degrees.add(target.id, count)
+        self.in_degrees.add((target.id, label), count)
+        if count > 0:
+            if label not in self.targets:
+                self.targets[label] = HyperLogLog(self.precision)
+            self.targets[label].add(target.id)
+
+    def insert(self, owner, node):
+        """
+        New Nodes have no relations yet, so nothing is counted.
+        """
+
+    def link(self, source, target, label):
+        """
+        Count a relation that was created.
+
+        Args:
+            source (Node): The Node the relation is from.
+            target (Node): The Node the relation is to.
+            label (any): The label of the relation.
+        """
+        self._count(source, target, label, 1)
+        self.changed = True
+        if self.pending is not None:
+            self.pending.append((source, target, label, 1))
+
+    def unlink(self, source, target, label):
+        """
+        Uncount a relation that was removed.
+
+        Args:
+            source (Node): The Node the relation was from.
+            target (Node): The Node the relation was to.
+            label (any): The label of the relation.
+        """
+        self._count(source, target, label, -1)
+        self.changed = True
+        if self.pending is not None:
+            self.pending.append((source, target, label, -1))
+
+    def rebuild(self):
+        """
+        Rebuild on the next read, used after Nodes are removed or reloaded.
+        """
+        self.changed = True
+        self.built = None
+
+    def refresh(self):
+        """
+        Start rebuilding the sketches in the background if the Database
+        changed and they are older than max_age seconds, or Nodes were
+        removed. Readers never wait for a write in progress, the rebuild
+        starts on a later read instead.
+        """
+        if not self.changed or self.thread is not None:
+            return
+        if self.built is not None and monotonic() - self.built < self.max_age:
+            return
+        file = self.db.file
+        if not file.write_lock.acquire(blocking=False):
+            return
+        try:
+            if self.thread is not None:
+                return
+            # relations changed after the snapshot opens are replayed on
+            # the rebuilt sketches
+            snapshot = self.db.read_snapshot()
+            snapshot.open()
+            self.pending = []
+            self.changed = False
+            self.thread = Thread(
+                target=self._rebuild, args=(snapshot, monotonic()), daemon=True
+            )
+            self.thread.start()
+        finally:
+            file.write_lock.release()
+
+    def _rebuild(self, snapshot, started):
+        """
+        Build the sketches from snapshot and replace the current ones.
+
+        Args:
+            snapshot (Snapshot): The open Snapshot to build from.
+            started (float): When snapshot was opened.
+        """
+        sketches = None
+        try:
+            sketches = self._build(snapshot)
+        finally:
+            snapshot.close()
+            with self.db.file.write_lock:
+                if sketches is None:
+                    self.changed = True
+                else:
+                    self._adopt(sketches)
+                    for change in self.pending:
+                        self._count(*change)
+                    self.built = started
+                self.pending = None
+                self.thread = None
+
+    def reachable(self, node, hops=None):
+        """
+        Return the estimated number of distinct nodes reachable from node by
+        following at most hops relations, not counting node itself.
+
+        Args:
+            node (Node): The node to start from.
+            hops (int|None): The number of hops, defaults to the number of
+            hops the sketch was built for.
+
+        Returns:
+            (float): The estimated number of nodes.
+
+        Raises:
+            Exception: If hops is more than the sketch was built for.
+        """
+        self.refresh()
+        if hops is None:
+            hops = self.hops
+        if not 0 <= hops <= self.hops:
+            raise Exception(f"hops must be between 0 and {self.hops}")
+        if hops == 0 or node not in self.reach:
+            return 0.0
+        return self.reach[node][hops - 1]
+
+    def distinct_targets(self, label):
+        """
+        Return the estimated number of distinct nodes related to by label.
+
+        Args:
+            label (any): The label of the relations.
+
+        Returns:
+            (float): The estimated number of nodes.
+        """
+        self.refresh()
+        if label not in self.targets:
+            return 0.0
+        return self.targets[label].estimate()
+
+    def label_count(self, label):
+        """
+        Return the estimated number of relations with label.
+
+        Args:
+            label (any): The label of the relations.
+
+        Returns:
+            (int): The estimated number of relations.
+        """
+        self.refresh()
+        return self.labels.estimate(label)
+
+    def degree(self, node, label=None, incoming=False):
+        """
+        Return the estimated number of relations of node.
+
+        Args:
+            node (Node): The node to estimate the degree of.
+            label (any|None): If specified, only relations with label are
+            counted.
+            incoming (bool): If True, relations pointing at node are counted
+            instead of relations from node.
+
+        Returns:
+            (int): The estimated number of relations.
+        """
+        self.refresh()
+        degrees = self.in_degrees if incoming else self.out_degrees
+        if label is None:
+            return degrees.estimate(node.id)
+        return degrees.estimate((node.id, label))
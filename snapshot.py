@@ -0,0 +1,178 @@
+class Snapshot:
+    """
+    A Snapshot is a read-only, consistent view of a Database at the moment
+    it was opened. Writers keep going while it is open: the first time a
+    dict that the Snapshot can see is updated, the writer copies the whole
+    dict and the Snapshot keeps the original, so memory grows with the size
+    of the dicts changed, see FileOps.writable. Node data is not
+    versioned, reading it through a Snapshot returns its latest value.
+    """
+
+    def __init__(self, db):
+        """
+        Initialize a Snapshot of db.
+
+        Args:
+            db (Database): The Database to take a Snapshot of.
+
+        Returns:
+            (Snapshot): The initialized Snapshot object.
+        """
+        self.db = db
+        self.file = db.file
+        # (owner, attribute) -> the dict as it was when this snapshot opened
+        self.preimages = {}
+        self.closed = True
+
+    def __enter__(self):
+        """
+        Open this Snapshot.
+
+        Returns:
+            (Snapshot): This Snapshot.
+        """
+        self.open()
+        return self
+
+    def __exit__(self, *exc):
+        """
+        Close this Snapshot.
+        """
+        self.close()
+
+    def open(self):
+        """
+        Start tracking updates so this Snapshot keeps seeing the current
+        state of the Database.
+        """
+        # wait for any write in progress so it is not half visible
+        with self.file.write_lock:
+            self.file.snapshots.append(self)
+        self.closed = False
+
+    def close(self):
+        """
+        Stop tracking updates and release the dicts kept for this Snapshot.
+        """
+        with self.file.write_lock:
+            if self in self.file.snapshots:
+                self.file.snapshots.remove(self)
+        self.preimages = {}
+        self.closed = True
+
+    def view(self, owner, attr):
+        """
+        Return the dict owner.attr as it was when this Snapshot opened.
+
+        Args:
+            owner (object): The object holding the dict.
+            attr (str): The name of the attribute holding the dict.
+
+        Returns:
+            (dict): The dict as seen by this Snapshot.
+
+        Raises:
+            Exception: If this Snapshot is closed.
+        """
+        if self.closed:
+            raise Exception("snapshot is closed")
+
+        # read the live dict before checking for a preimage, writers store
+        # the preimage before replacing the live dict
+        current = getattr(owner, attr)
+        return self.preimages.get((owner, attr), current)
+
+    @property
+    def nodes(self):
+        """
+        Return the Nodes that are not in a Collection.
+
+        Returns:
+            (dict): The Nodes by key.
+        """
+        return self.view(self.file, "nodes")
+
+    @property
+    def collections(self):
+        """
+        Return the Collections.
+
+        Returns:
+            (dict): The Collections by name.
+        """
+        return self.view(self.file, "collections")
+
+    def collection_nodes(self, name):
+        """
+        Return the Nodes in a Collection.
+
+        Args:
+            name (str): The name of the Collection.
+
+        Returns:
+            (dict): The Nodes by key.
+        """
+        return self.view(self.collections[name], "nodes")
+
+    def relations(self, node):
+        """
+        Return the relations of a Node.
+
+        Args:
+            node (Node): The Node to return relations of.
+
+        Returns:
+            (dict): The related Nodes mapped to their label.
+        """
+        return self.view(node, "relations")
+
+    @property
+    def num_nodes(self):
+        """
+        Return the number of nodes in this Snapshot.
+
+        Returns:
+            (int): The number of nodes.
+        """
+        return len(self.nodes) + sum(
+            len(self.view(c, "nodes")) for c in self.collections.values()
+        )
+
+    @property
+    def associations(self):
+        """
+        Return the associations in this Snapshot.
+
+        Returns:
+            (dict): Lists of edges (tuple of nodes) by label.
+        """
+        return self.db.find_associations(snapshot=self)
+
+    @property
+    def num_associations(self):
+        """
+        Return the number of associations in this Snapshot.
+
+        Returns:
+            (int): The number of associations.
+        """
+        return sum(len(i) for i in self.associations.values())
+
+    def related_by(self, node, label):
+        """
+        Return a list of nodes related to node by label.
+
+        Returns:
+            (list): List of Node objects related to node by label.
+        """
+        return node.related_by(label, snapshot=self)
+
+    def related_difference(self, node, label_1, label_2):
+        """
+        Return a dict of nodes that are directly related to node by label_1
+        and indirectly related by label_2, see Node.related_difference.
+
+        Returns:
+            (dict): The indirectly related Nodes and their degree of relation.
+        """
+        return node.related_difference(label_1, label_2, snapshot=self)
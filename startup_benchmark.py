@@ -0,0 +1,127 @@
+import json
+import os
+import subprocess
+import sys
+from statistics import median
+from time import perf_counter as timer
+
+# run in a fresh interpreter for every measurement, so nothing is imported
+# or cached yet, and report each phase in seconds as JSON
+CHILD = """
+from time import perf_counter as timer
+start = timer()
+from database import Database
+imported = timer()
+db = Database({data!r}, lazy={lazy})
+opened = timer()
+if {query!r} == "count":
+    db.num_nodes
+else:
+    db.collections["users"].nodes["user0"].related_by("FOLLOWS")
+queried = timer()
+import json
+print(json.dumps({{
+    "import": imported - start,
+    "open": opened - imported,
+    "query": queried - opened,
+}}))
+"""
+
+
+def seed(data, nodes):
+    """
+    Create a users collection of nodes that each follow the next 5 users.
+    """
+    from database import Database
+
+    db = Database(data)
+    if "users" in db.collections:
+        return
+    with db.file.batch():
+        users = db.add("users")
+        created = [
+            users.insert({"num": n}, key=f"user{n}") for n in range(nodes)
+        ]
+        for n, node in enumerate(created):
+            for i in range(1, 6):
+                node.relate_to(created[(n + i) % nodes], by="FOLLOWS")
+    db.close()
+
+
+def measure(data, lazy, query):
+    """
+    Open data in a new process and time it.
+
+    Returns:
+        (dict): The seconds spent importing, opening, running the first
+        query and in the whole process including interpreter startup.
+    """
+    start = timer()
+    output = subprocess.run(
+        [
+            sys.executable,
+            "-c",
+            CHILD.format(data=data, lazy=lazy, query=query),
+        ],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        check=True,
+        capture_output=True,
+        text=True,
+    ).stdout
+    elapsed = timer() - start
+    # the last line holds the timings, eager opens print a message first
+    result = json.loads(output.strip().splitlines()[-1])
+    result["process"] = elapsed
+    return result
+
+
+def main(data, nodes, runs, query, budget):
+    """
+    Seed a database and report the median startup time of each open mode.
+
+    Returns:
+        (int): 1 if the lazy startup exceeded budget, otherwise 0.
+    """
+    seed(data, nodes)
+    phases = ("import", "open", "query", "process")
+    print(f"{'mode':<6}" + "".join(f"{p:>10}" for p in phases))
+    totals = {}
+    for lazy in (False, True):
+        results = [measure(data, lazy, query) for _ in range(runs)]
+        medians = {p: median(r[p] for r in results) for p in phases}
+        totals[lazy] = median(
+            r["import"] + r["open"] + r["query"] for r in results
+        )
+        print(
+            f"{'lazy' if lazy else 'eager':<6}"
+            + "".join(f"{medians[p] * 1000:>8.1f}ms" for p in phases)
+        )
+
+    print(f"import + open + first {query}: {totals[True] * 1000:.1f}ms lazy")
+    if budget is not None and totals[True] * 1000 > budget:
+        print(f"over the startup budget of {budget:.1f}ms")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description="Measure import plus first query latency of GrapevineDB."
+    )
+    parser.add_argument("--data", default="startup_data")
+    parser.add_argument("--nodes", type=int, default=10000)
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument(
+        "--query", choices=("count", "lookup"), default="lookup"
+    )
+    parser.add_argument(
+        "--budget",
+        type=float,
+        default=None,
+        help="fail if lazy import + open + first query takes longer (ms)",
+    )
+    args = parser.parse_args()
+
+    sys.exit(main(args.data, args.nodes, args.runs, args.query, args.budget))
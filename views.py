@@ -0,0 +1,177 @@
+# stands in for a relation that does not exist
+MISSING = object()
+
+
+class MaterializedView:
+    """
+    A MaterializedView keeps, for every Node it tracks, how many of the Nodes
+    it relates to by label_1 relate to each other Node by label_2, such as
+    how many friends of a user like each page. The counts are updated as
+    relations are created and removed, so reading them is a dict lookup
+    and each update only visits the Nodes next to the changed relation.
+    """
+
+    def __init__(self, file, label_1, label_2, collection=None):
+        """
+        Initialize a MaterializedView and build it from the Nodes in file.
+
+        Args:
+            file (FileOps): The FileOps object of the Database.
+            label_1 (any): The label of the direct relations.
+            label_2 (any): The label of the indirect relations.
+            collection (str|None): If specified, only Nodes in this
+            Collection are tracked, otherwise every Node is.
+
+        Returns:
+            (MaterializedView): The initialized MaterializedView object.
+        """
+        self.file = file
+        self.label_1 = label_1
+        self.label_2 = label_2
+        self.collection = collection
+        self.rebuild()
+
+    def rebuild(self):
+        """
+        Recount the view from every relation in the Database, used when it
+        is created and after Nodes are removed or reloaded.
+        """
+        # tracked nodes, None when every node is tracked
+        self.members = None
+        if self.collection is not None:
+            self.members = set()
+            if self.collection in self.file.collections:
+                nodes = self.file.collections[self.collection].nodes
+                self.members.update(nodes.values())
+        # node -> tracked nodes relating to it by label_1
+        self.sources = {}
+        # node -> nodes it relates to by label_2
+        self.targets = {}
+        # tracked node -> candidate -> count
+        self.counts = {}
+        # relations to removed nodes are still followed, as they are by
+        # Node.related_difference
+        nodes = list(self.file.iter_nodes())
+        removed = {
+            relation
+            for node in nodes
+            for relation in node.relations
+            if relation.id not in self.file.index
+        }
+        for node in nodes + list(removed):
+            for relation, label in node.relations.items():
+                self.link(node, relation, label)
+
+    def tracks(self, node):
+        """
+        Return whether counts are kept for node.
+
+        Returns:
+            (bool): True if node is tracked.
+        """
+        return self.members is None or node in self.members
+
+    def insert(self, owner, node):
+        """
+        Start tracking node if it was inserted into the tracked Collection.
+
+        Args:
+            owner (object): The Database file or Collection node was
+            inserted into.
+            node (Node): The inserted Node.
+        """
+        if self.members is not None:
+            if getattr(owner, "name", None) == self.collection:
+                self.members.add(node)
+
+    def link(self, source, target, label):
+        """
+        Count the paths through a relation that was created.
+
+        Args:
+            source (Node): The Node the relation is from.
+            target (Node): The Node the relation is to.
+            label (any): The label of the relation.
+        """
+        if label == self.label_1 and self.tracks(source):
+            if source not in self.sources.get(target, ()):
+                self.sources.setdefault(target, set()).add(source)
+                for candidate in self.targets.get(target, ()):
+                    self._add(source, candidate, 1)
+        targets = self.targets.get(source, ())
+        if label == self.label_2 and target not in targets:
+            self.targets.setdefault(source, set()).add(target)
+            for node in self.sources.get(source, ()):
+                self._add(node, target, 1)
+
+    def unlink(self, source, target, label):
+        """
+        Uncount the paths through a relation that was removed, in the
+        opposite order to link.
+
+        Args:
+            source (Node): The Node the relation was from.
+            target (Node): The Node the relation was to.
+            label (any): The label of the relation.
+        """
+        if label == self.label_2 and target in self.targets.get(source, ()):
+            for node in self.sources.get(source, ()):
+                self._add(node, target, -1)
+            self._discard(self.targets, source, target)
+        if label == self.label_1 and source in self.sources.get(target, ()):
+            for candidate in self.targets.get(target, ()):
+                self._add(source, candidate, -1)
+            self._discard(self.sources, target, source)
+
+    def _add(self, node, candidate, count):
+        """
+        Add count to the count of candidate for node.
+        """
+        counts = self.counts.setdefault(node, {})
+        counts[candidate] = counts.get(candidate, 0) + count
+        if not counts[candidate]:
+            del counts[candidate]
+            if not counts:
+                del self.counts[node]
+
+    def _discard(self, sets, key, value):
+        """
+        Remove value from the set stored under key in sets.
+        """
+        sets[key].discard(value)
+        if not sets[key]:
+            del sets[key]
+
+    def get(self, node):
+        """
+        Return the candidates of node, like Node.related_difference limited
+        to two hops: every Node related by label_2 to a Node related to node
+        by label_1, leaving out node and the Nodes it relates to by label_1.
+
+        Args:
+            node (Node): The Node to return candidates for.
+
+        Returns:
+            (dict): The candidate Nodes and the number of paths to each.
+        """
+        relations = node.relations
+        return {
+            candidate: count
+            for candidate, count in self.counts.get(node, {}).items()
+            if candidate is not node
+            and relations.get(candidate, MISSING) != self.label_1
+        }
+
+    def count(self, node, candidate):
+        """
+        Return the number of paths from node to candidate.
+
+        Args:
+            node (Node): The tracked Node.
+            candidate (Node): The candidate Node.
+
+        Returns:
+            (int): The number of Nodes related to node by label_1 that are
+            related to candidate by label_2.
+        """
+        return self.counts.get(node, {}).get(candidate, 0)